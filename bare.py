@@ -5,6 +5,9 @@
 # http://en.chessbase.com/post/reconstructing-turing-s-paper-machine
 
 from pst import pst
+import material
+import stats
+import rootsplit
 
 import chess as c
 import sys, math, time
@@ -17,12 +20,17 @@ PLAYC = c.WHITE
 MAXPLIES = 3	# maximum search depth
 PSTAB    = .5	# influence of piece-square table on moves, 0 = none
 MATETEST  = True	# if True, include draw and mate on next move detection in the material eval
+THREADS   = 1	# number of processes searching the root moves (see rootsplit.py)
+PARAMS    = 'COMPC', 'PLAYC', 'MAXPLIES', 'PSTAB', 'MATETEST'	# globals needed by searchroot()
 
 b = c.Board()
 NODES = 0
+STATS = stats.new()	# statistics of the current search
+MAT = []	# piece counts of the current search position
 
 def getpos(b):
 	"Get positional-play value for a board"
+	STATS['getpos'] += 1
 	ppv = 0
 	for i in b.piece_map().keys():
 		m = b.piece_at(i)
@@ -38,29 +46,36 @@ def getpos(b):
 				ppv -= PSTAB * pst[mm][i]               / 100
 	return ppv
 
-def getval(b):
-	"Get total piece value of board"
+def getval(b, n = None):
+	"Get total piece value of board (n: piece counts, if they are already known)"
+	if n is None:
+		n = material.count(b)
+	wn, bn = n[c.WHITE], n[c.BLACK]
 	return (
-		len(b.pieces(c.PAWN, c.WHITE))          - len(b.pieces(c.PAWN, c.BLACK))
-	+	2.8 * (len(b.pieces(c.KNIGHT, c.WHITE))   - len(b.pieces(c.KNIGHT, c.BLACK)))
-	+	3.2 * (len(b.pieces(c.BISHOP, c.WHITE))   - len(b.pieces(c.BISHOP, c.BLACK)))
-	+	4.79 * (len(b.pieces(c.ROOK, c.WHITE))     - len(b.pieces(c.ROOK, c.BLACK)))
-	+	9.29 * (len(b.pieces(c.QUEEN, c.WHITE))    - len(b.pieces(c.QUEEN, c.BLACK)))
+		wn[c.PAWN]          - bn[c.PAWN]
+	+	2.8 * (wn[c.KNIGHT] - bn[c.KNIGHT])
+	+	3.2 * (wn[c.BISHOP] - bn[c.BISHOP])
+	+	4.79 * (wn[c.ROOK]  - bn[c.ROOK])
+	+	9.29 * (wn[c.QUEEN] - bn[c.QUEEN])
 	)
 
 # https://chessprogramming.org/Alpha-Beta
 def searchmax(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, MAT
 
 	NODES += 1
+	if ply == 0:	# new search tree
+		MAT = material.count(b)
 	if ply >= MAXPLIES:
-		return getval(b)
-	for x in order(b, ply):
-		b.push(x)
+		STATS['evals'] += 1
+		return getval(b, MAT)
+	for i, x in enumerate(order(b, ply)):
+		material.push(MAT, b, x)
 		t = searchmin(b, ply + 1, alpha, beta)
-		b.pop()
+		material.pop(MAT, b)
 		if t >= beta:
+			stats.cutoff(STATS, i)
 			return beta
 		if t > alpha:
 			alpha = t
@@ -68,16 +83,20 @@ def searchmax(b, ply, alpha, beta):
 
 def searchmin(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, MAT
 
 	NODES += 1
+	if ply == 0:	# new search tree
+		MAT = material.count(b)
 	if ply >= MAXPLIES:
-		return getval(b)
-	for x in order(b, ply):
-		b.push(x)
+		STATS['evals'] += 1
+		return getval(b, MAT)
+	for i, x in enumerate(order(b, ply)):
+		material.push(MAT, b, x)
 		t = searchmax(b, ply + 1, alpha, beta)
-		b.pop()
+		material.pop(MAT, b)
 		if t <= alpha:
+			stats.cutoff(STATS, i)
 			return alpha
 		if t < beta:
 			beta = t
@@ -109,11 +128,36 @@ def pm():
 	else:
 		return -1
 
+def searchroot(b, x, lastpos):
+	"Search root move x, return (move, positional value, score)"
+	t0 = time.time()
+	b.push(x)
+	p = getpos(b) - lastpos
+	t0 = stats.phase(STATS, 'pos', t0)
+	if COMPC == c.WHITE:
+		t = searchmin(b, 0, -1e6, 1e6)
+	else:
+		t = searchmax(b, 0, -1e6, 1e6)
+	if MATETEST:
+		res = b.result(claim_draw = True)
+		if res == '1/2-1/2':
+			t = 0
+		if res == '1-0':
+			t = 1e8
+		if res == '0-1':
+			t = -1e8
+	stats.phase(STATS, 'search', t0)
+	b.pop()
+	return x, p, t
+
 def getmove(b, silent = False, usebook = False):
 	"Get move list for board"
-	global COMPC, PLAYC, MAXPLIES, NODES
+	global COMPC, PLAYC, MAXPLIES, NODES, STATS
 
+	STATS = stats.new()
+	t0 = time.time()
 	lastpos = getpos(b)
+	stats.phase(STATS, 'pos', t0)
 	ll = []
 	NODES = 0
 
@@ -132,25 +176,10 @@ def getmove(b, silent = False, usebook = False):
 	nl = len(list(b.legal_moves))
 
 	start = time.time()
-	for n, x in enumerate(b.legal_moves):
-		b.push(x)
-		p = getpos(b) - lastpos
-		if COMPC == c.WHITE:
-			t = searchmin(b, 0, -1e6, 1e6)
-		else:
-			t = searchmax(b, 0, -1e6, 1e6)
-		if MATETEST:
-			res = b.result(claim_draw = True)
-			if res == '1/2-1/2':
-				t = 0
-			if res == '1-0':
-				t = 1e8
-			if res == '0-1':
-				t = -1e8
+	for n, (x, p, t) in enumerate(rootsplit.search(sys.modules[__name__], b, list(b.legal_moves), lastpos)):
 		if not silent:
 			print("(%u/%u) %s %.1f %.2f" % (n + 1, nl, x, p, t))
 		ll.append((x, p, t))
-		b.pop()
 
 	ll.sort(key = lambda m: m[1] + 1000 * m[2])
 	if COMPC == c.WHITE:
@@ -158,6 +187,7 @@ def getmove(b, silent = False, usebook = False):
 	print('# %.2f %s' % (ll[0][1] + ll[0][2], [str(ll[0][0])]))
 	print('info depth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1,
 		100 * pm () * ll[0][2], 1000 * (time.time() - start), NODES, str(ll[0][0])))
+	stats.info(STATS, NODES, MAXPLIES + 1, 'Bare')
 	return ll[0][1] + ll[0][2], [str(ll[0][0])]
 
 if __name__ == '__main__':
@@ -3,6 +3,8 @@
 # The Bernstein chess engine (1958)
 
 import chess as c
+import stats
+import rootsplit
 import sys, math, time
 
 # computer plays as Black by default
@@ -15,16 +17,20 @@ PMTLEN   = 7	# size of Plausible Move Table
 PMTSTART = 0	# first ply where the PMT is used,
 		#    so e.g. PMTSTART = 2 means the PMT will not be used during the first two plies
 MATETEST = True
+THREADS  = 1	# number of processes searching the root moves (see rootsplit.py)
+PARAMS   = 'COMPC', 'PLAYC', 'MAXPLIES', 'PMTLEN', 'PMTSTART', 'MATETEST'	# globals needed by searchroot()
 
 b = c.Board()
 PV = []		# array for primary variation
 NODES = 0
+STATS = stats.new()	# statistics of the current search
 
 def ppos(x, r):
 	print(c.SQUARE_NAMES[x], r)
 
 def getpos(b):
 	"Get positional-play value for a board"
+	STATS['getpos'] += 1
 
 	# 1. number of available moves
 	u = b.copy()
@@ -62,6 +68,7 @@ def getpos(b):
 
 def getneg(b):
 	"Board value in the Negamax framework, i.e. '+' means the side to move has the advantage"
+	STATS['evals'] += 1
 	return .001 * getpos(b) + (
 		     len(b.pieces(c.PAWN, b.turn))     - len(b.pieces(c.PAWN, not b.turn))
 	+	3 * (len(b.pieces(c.KNIGHT, b.turn))   - len(b.pieces(c.KNIGHT, not b.turn)))
@@ -264,6 +271,7 @@ def searchmax(b, ply, alpha, beta):
 	v = PV
 	mypmt = get_pmt(b)
 
+	i = 0	# number of moves searched
 	for x in o:
 		if ply + 1 >= PMTSTART and str(x) not in mypmt:
 			continue
@@ -272,10 +280,12 @@ def searchmax(b, ply, alpha, beta):
 		t = -t
 		b.pop()
 		if t >= beta:
+			stats.cutoff(STATS, i)
 			return beta, vv
 		if t > alpha:
 			alpha = t
 			v = vv
+		i += 1
 	if MATETEST:
 		res = b.result(claim_draw = True)
 		if res == '1/2-1/2':
@@ -302,9 +312,17 @@ def order(b, ply):
 	bm = [q[0] for q in am]
 	return bm
 
+def searchroot(b, x):
+	"Search root move x, return (move, score, primary variation)"
+	b.push(x)
+	u = b.copy()
+	t, pv = searchmax(u, 0, -1e6, 1e6)
+	b.pop()
+	return x, -t, pv[len(b.move_stack):]
+
 def getmove(b, silent = False, usebook = False):
 	"Get move list for board"
-	global COMPC, PLAYC, MAXPLIES, NODES
+	global COMPC, PLAYC, MAXPLIES, NODES, STATS
 
 	ll = []
 
@@ -322,8 +340,10 @@ def getmove(b, silent = False, usebook = False):
 
 	start = time.time()
 	NODES = 0
+	STATS = stats.new()
 	nl = len(list(b.legal_moves))
 
+	t0 = time.time()
 	pmt = get_pmt(b)
 	for n, x in enumerate(b.legal_moves):
 		b.push(x)
@@ -332,26 +352,23 @@ def getmove(b, silent = False, usebook = False):
 			return 1e6, [str(x)]
 		else:
 			b.pop()
+	t0 = stats.phase(STATS, 'pmt', t0)
 
-	for n, x in enumerate(b.legal_moves):
-		if PMTSTART == 0 and str(x) not in pmt:
-			continue
+	ml = [(n, x) for n, x in enumerate(b.legal_moves) if PMTSTART != 0 or str(x) in pmt]
+	res = rootsplit.search(sys.modules[__name__], b, [m[1] for m in ml])
+	for m, (x, t, PV) in zip(ml, res):
 		print()
 		print('# ', str(x))
-		b.push(x)
-		u = b.copy()
-		t, PV = searchmax(u, 0, -1e6, 1e6)
-		t = -t
-		PV = PV[len(b.move_stack) - 1:]
-		print("# (%u/%u) %s %.2f" % (n + 1, nl, x, t))
+		print("# (%u/%u) %s %.2f" % (m[0] + 1, nl, x, t))
 		print('# ', PV)
 		ll.append((x, t, PV))
-		b.pop()
+	stats.phase(STATS, 'search', t0)
 
 	ll.sort(key = lambda m: m[1])
 	ll.reverse()
 	print('info depth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1, 100 * ll[0][1],
 		1000 * (time.time() - start), NODES, ' '.join(ll[0][2])))
+	stats.info(STATS, NODES, MAXPLIES + 1, 'Bernstein')
 	return ll[0][1], [str(ll[0][0])]
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Draw detection for the engine searches without replaying the game:
+#   the keys of the positions since the last irreversible move are kept on a stack,
+#   so b.result(claim_draw = True) can be answered by looking at these positions only
+#   (python-chess scans the whole move stack for fivefold repetitions and
+#   replays the last moves for threefold repetitions at every call).
+
+import chess as c
+from collections import Counter
+
+def key(b):
+	"Position key for repetitions (the same as python-chess uses)"
+	return (b.pawns, b.knights, b.bishops, b.rooks, b.queens, b.kings,
+		b.occupied_co[c.WHITE], b.occupied_co[c.BLACK], b.turn, b.clean_castling_rights(),
+		b.ep_square if b.has_legal_en_passant() else None)
+
+def start(b):
+	"Get the key stack for a board: the keys of the positions since the last irreversible move, the current one last"
+	s = [key(b)]
+	d = b.copy(stack = b.halfmove_clock + 1)	# (taking back moves on b itself would also give back a changed side to move)
+	while d.move_stack:
+		x = d.pop()
+		if d.is_irreversible(x):
+			break
+		s.append(key(d))
+	s.reverse()
+	return [None] + s	# (None marks the start of the positions since an irreversible move)
+
+def push(s, b):
+	"Add the position on board b to key stack s after a move has been made"
+	k = key(b)
+	p = s[-1]
+	# irreversible moves: captures and pawn moves, moves that lose castling rights
+	#   and all moves from a position with an en passant capture (as in Board.is_irreversible())
+	if not b.halfmove_clock or k[9] != p[9] or p[10] is not None:
+		s.append(None)
+	s.append(k)
+
+def pop(s):
+	"Remove the last position from key stack s when its move is taken back"
+	s.pop()
+	if s[-1] is None and len(s) > 1:
+		s.pop()
+
+def result(b, s):
+	"Get b.result(claim_draw = True) for board b, whose position is the last one on key stack s"
+	if not any(b.generate_legal_moves()):
+		if b.is_check():
+			return '0-1' if b.turn == c.WHITE else '1-0'
+		return '1/2-1/2'	# stalemate
+	if b.is_insufficient_material() or b.halfmove_clock >= 100:	# (75-move rule and 50-move rule)
+		return '1/2-1/2'
+	n = Counter()
+	for i in range(len(s) - 1, -1, -1):
+		if s[i] is None:
+			break
+		n[s[i]] += 1
+	k = s[-1]
+	if n[k] >= 3:	# fivefold or threefold repetition
+		return '1/2-1/2'
+	if b.halfmove_clock >= 99:	# can a move reach the 50-move rule?
+		for x in b.generate_legal_moves():
+			if not b.is_zeroing(x):
+				b.push(x)
+				try:
+					if any(b.generate_legal_moves()):
+						return '1/2-1/2'
+				finally:
+					b.pop()
+	# can a move repeat a position for the third time?
+	if any(m >= 2 and j[8] != b.turn for j, m in n.items()):
+		for x in b.generate_legal_moves():
+			b.push(x)
+			try:
+				if n[key(b)] >= 2:
+					return '1/2-1/2'
+			finally:
+				b.pop()
+	return '*'
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Incremental material counting for the engine searches:
+#   the piece counts are updated on every move and take-back,
+#   so evaluating the material of a leaf position needs no board scan.
+
+import chess as c
+
+def count(b):
+	"Get piece counts of a board, indexed by [color][piece type]"
+	return [[0] + [len(b.pieces(t, col)) for t in c.PIECE_TYPES] for col in (c.BLACK, c.WHITE)]
+
+def change(n, b, x, d):
+	"Add d times the material change of move x to piece counts n (b is the board before the move)"
+	# same bookkeeping as Board.push(), so the counts stay right
+	#   even if the side to move was changed by hand (e.g. Newt's null move)
+	t = b.piece_type_at(x.from_square)
+	i = x.to_square
+	if t == c.KING and x.from_square in (c.E1, c.E8) and i - x.from_square in (2, -2) and not b.rooks & c.BB_SQUARES[i]:
+		i = i + 1 if i > x.from_square else i - 2	# e1g1 is played as e1h1, e1c1 as e1a1
+	if t == c.KING and b.occupied_co[b.turn] & c.BB_SQUARES[i]:
+		return		# castling
+	n[b.color_at(x.from_square)][t] -= d
+	col = b.color_at(i)
+	if col is not None:
+		n[col][b.piece_type_at(i)] -= d
+	elif t == c.PAWN and i == b.ep_square and abs(i - x.from_square) in (7, 9):
+		i = i - 8 if b.turn == c.WHITE else i + 8	# en passant
+		col = b.color_at(i)
+		if col is not None:
+			n[col][b.piece_type_at(i)] -= d
+	n[b.turn][x.promotion or t] += d
+
+def push(n, b, x):
+	"Make a move and update piece counts n"
+	change(n, b, x, 1)
+	b.push(x)
+
+def pop(n, b):
+	"Take back a move and update piece counts n"
+	x = b.pop()
+	change(n, b, x, -1)
+	return x
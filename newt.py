@@ -3,8 +3,12 @@
 # A Python chess engine
 
 from pst import pst
+import material
+import draws
+import stats
 
 import chess as c
+from chess.polyglot import zobrist_hash
 import os, sys, math, time
 from random import choice
 
@@ -23,17 +27,34 @@ USEBOOK = True	# use opening book
 MATETEST  = True	# if True, include mate and draw detection in the material eval
 MAXNODES = 1e6	# stop search when MAXNODES nodes are reached,
 		#   to avoid crashing the machine on longer time controls
+HARDTIME = 3	# with a clock, stop the search at this many times the planned time for the move (at most half the clock)
+EXTEND = 2	# multiply the planned time by this when the best move changes from one iteration to the next
+BOOKFILE = "chess-eco.pos.txt"	# opening lines with their ECO codes
 
 b = c.Board()
 PV = []		# array for primary variation
+PVMOVES = set()	# the moves of PV, for move ordering
+PVT = []	# triangular PV table: PVT[d][d:PVLEN[d]] is the best line found at distance d from the root
+PVLEN = []	# end of each line in PVT, -1 = none (the search then fails)
+ROOT = 0	# length of the move stack at the root
+KILLERS = {}	# two killer moves (quiet moves that caused a beta cutoff) for each search depth (length of the move stack)
+HISTORY = 4096 * [0]	# history scores of quiet moves that caused beta cutoffs, indexed by 64 * from square + to square
 NODES = 0
+STATS = stats.new()	# statistics of the current search
+MAT = []	# piece counts of the current search position
+REP = []	# keys of the positions since the last irreversible move along the search path (see draws.py), None = use Board.result()
+BOOK = None	# opening book: Zobrist hash of a position -> book moves (UCI), built by the first getopen()
+ECO = {}	# Zobrist hash -> (ECO code, opening name) of the positions at the end of the book lines
 
 wtime, btime, movestogo, movetime = -1, -1, -1, -1	# time management variables
-endtime = time.time() + 1e8
+endtime = time.time() + 1e8	# hard limit: the search is stopped then
+softtime = endtime	# soft limit: no new iteration is started after it
+timeout = False	# has endtime been reached? (the clock is only read every 256 nodes)
 searchok = True
 
 def getpos(b):
 	"Get positional-play value for a board for both players"
+	STATS['getpos'] += 1
 	ppv = 0
 	if not moves and b.is_checkmate():
 		if b.turn == c.WHITE:
@@ -53,22 +74,26 @@ def getpos(b):
 			ppv -= PSTAB * pst[mm][i]               / 100
 	return ppv
 
-def getval(b):
-	"Get total piece value of board"
+def getval(b, n = None):
+	"Get total piece value of board (n: piece counts, if they are already known)"
+	if n is None:
+		n = material.count(b)
+	wn, bn = n[c.WHITE], n[c.BLACK]
 	return (
-		len(b.pieces(c.PAWN, c.WHITE))          - len(b.pieces(c.PAWN, c.BLACK))
-	+	2.8 * (len(b.pieces(c.KNIGHT, c.WHITE))   - len(b.pieces(c.KNIGHT, c.BLACK)))
-	+	3.2 * (len(b.pieces(c.BISHOP, c.WHITE))   - len(b.pieces(c.BISHOP, c.BLACK)))
-	+	4.79 * (len(b.pieces(c.ROOK, c.WHITE))     - len(b.pieces(c.ROOK, c.BLACK)))
-	+	9.29 * (len(b.pieces(c.QUEEN, c.WHITE))    - len(b.pieces(c.QUEEN, c.BLACK)))
+		wn[c.PAWN]          - bn[c.PAWN]
+	+	2.8 * (wn[c.KNIGHT] - bn[c.KNIGHT])
+	+	3.2 * (wn[c.BISHOP] - bn[c.BISHOP])
+	+	4.79 * (wn[c.ROOK]  - bn[c.ROOK])
+	+	9.29 * (wn[c.QUEEN] - bn[c.QUEEN])
 	)
 
 def getneg(b):
 	"Board value in the Negamax framework, i.e. '+' means the side to move has the advantage"
+	STATS['evals'] += 1
 	if b.turn:
-		return getval(b) + getpos(b)
+		return getval(b, MAT) + getpos(b)
 	else:
-		return -getval(b) - getpos(b)
+		return -getval(b, MAT) - getpos(b)
 
 def isdead(b, p):
 	"Is the position dead? (quiescence) E.g., can the capturing piece be recaptured? Is there a check on this or the last move?"
@@ -86,48 +111,87 @@ def isdead(b, p):
 
 # https://chessprogramming.org/Alpha-Beta
 def searchmax(b, ply, alpha, beta):
-	"Search moves and evaluate positions for player whose turn it is"
-	global moves, NODES, searchok
+	"Search moves and evaluate positions for player whose turn it is (the best line found is put into PVT)"
+	global moves, NODES, searchok, timeout
 
 	moves = [q for q in b.legal_moves]
 	NODES += 1
+	if not NODES & 255 and time.time() >= endtime:
+		timeout = True
+	d = len(b.move_stack) - ROOT
+	if ply < 0:	# (beyond the full-width depth)
+		STATS['qnodes'] += 1
 	if MATETEST:
-		res = b.result(claim_draw = True)
+		res = draws.result(b, REP) if REP is not None else b.result(claim_draw = True)
 		if res == '1/2-1/2':
-			return 0, PV
+			PVLEN[d] = -1
+			return 0
 	if ply <= 0 and isdead(b, ply):
-		return getneg(b), [str(q) for q in b.move_stack]
+		PVLEN[d] = d
+		return getneg(b)
 	o = order(b, ply)
 	if ply <= 0:
 		if not o:
-			return getneg(b), [str(q) for q in b.move_stack]
-	v = PV
-	for x in o:
-		b.push(x)
-		if (time.time() < endtime and NODES < MAXNODES) or MAXPLIES == 1:
-			t, vv = searchmax(b, ply - 1, -beta, -alpha)
-		else:
-			searchok = False
-			return alpha, v
-		t = -t
-		b.pop()
+			PVLEN[d] = d
+			return getneg(b)
+	PVLEN[d] = -1
+	for i, x in enumerate(o):
+		if (timeout or NODES >= MAXNODES) and MAXPLIES != 1:
+			searchok = False	# (before the move, so that the board and the piece counts stay right)
+			return alpha
+		material.push(MAT, b, x)
+		if REP is not None:
+			draws.push(REP, b)
+		t = -searchmax(b, ply - 1, -beta, -alpha)
+		if REP is not None:
+			draws.pop(REP)
+		material.pop(MAT, b)
 		if t >= beta:
-			return beta, vv
+			stats.cutoff(STATS, i)
+			if ply >= 0 and not b.is_capture(x):
+				killer(b, x, ply)
+			newline(d, x)
+			return beta
 		if t > alpha:
 			alpha = t
-			v = vv
-	return alpha, v
+			newline(d, x)
+	return alpha
+
+def newline(d, x):
+	"Make move x and the line below it the best line at distance d from the root"
+	# (https://chessprogramming.org/Triangular_PV-Table)
+	n = PVLEN[d + 1]
+	if n < 0:	# no line, e.g. after a draw
+		PVLEN[d] = -1
+		return
+	l = PVT[d]
+	l[d] = x
+	l[d + 1:n] = PVT[d + 1][d + 1:n]
+	PVLEN[d] = n
+
+def killer(b, x, ply):
+	"Remember quiet move x, which caused a beta cutoff on board b with ply plies left, for move ordering"
+	# (https://chessprogramming.org/Killer_Heuristic, https://chessprogramming.org/History_Heuristic)
+	k = KILLERS.setdefault(len(b.move_stack), [None, None])
+	if x != k[0]:
+		k[1] = k[0]
+		k[0] = x
+	HISTORY[64 * x.from_square + x.to_square] += (ply + 1) ** 2
 
 def order(b, ply):
 	"Move ordering"
-	if ply >= 0:		# try moves from PV before others
-		am, bm = [], []
+	if ply >= 0:		# try moves from PV before others, then the killer moves, then the others by history score
+		k = KILLERS.get(len(b.move_stack), ())
+		am, bm, cm = [], [], []
 		for x in moves:
-			if str(x) in PV:
+			if x in PVMOVES:
 				am.append(x)
-			else:
+			elif x in k:
 				bm.append(x)
-		return am + bm
+			else:
+				cm.append(x)
+		cm.sort(key = lambda x: -HISTORY[64 * x.from_square + x.to_square])
+		return am + bm + cm
 
 	# quiescence search (ply < 0), sort captures by MVV/LVA value
 	am, bm = [], []
@@ -144,67 +208,63 @@ def order(b, ply):
 	bm = [q[0] for q in am]
 	return bm
 
-def getnewmove(m, n):
-	if len(m) <= len(n):
-		return []
-	i = 0
-	for x, y in zip(m, n):
-		if x == y:
-			i += 1
-		else:
-			break
-	if i == len(n):
-		return m[i]
-	else:
-		return []
-
-try:
-	ob = open("chess-eco.pos.txt").readlines()
-except:
-	print("Opening book not found!")
-	ob = []
+def readbook():
+	"Build the opening book index from BOOKFILE"
+	global BOOK
 
-def getopen(b):
-	"Identify opening and get a book move if possible"
-	op = []
+	BOOK = {}
+	try:
+		ob = open(BOOKFILE).readlines()
+	except:
+		print("Opening book not found!")
+		return
+	# the lines are sorted, so each one is played on from the moves that it shares with the one before
 	d = c.Board()
-	for x in b.move_stack:
-		op.append(d.san(x))
-		d.push(x)
-	played = '%s' % (' '.join(op))
-
-	hits = []
-	id = '', '', ''
-	sm = []
-
+	last = []
+	keys = [zobrist_hash(d)]	# of the positions on d
 	for l in ob:
 		h5 = l.split('"')
 		if len(h5) > 5:
-			eco, name, mv = h5[1], h5[3], h5[5]
-			if played[:len(mv)] == mv:
-				if len(mv) > len(id[1]):
-					id = name, mv, eco
-			sm1 = getnewmove(mv.split(), op)
-			try:
-				if sm1:
-					sm1 = str(b.parse_san(sm1))
-			except:
-				#print("# Illegal book move", sm1)
-				sm1 = []
-			if sm1 and sm1 not in sm:
-				sm.append(sm1)
-	#print('# %s %s  (%s)' % (id[2], id[0], id[1]))
-	return sm
+			eco, name, mv = h5[1], h5[3], h5[5].split()
+			i = 0
+			while i < len(d.move_stack) and i < len(mv) and mv[i] == last[i]:
+				i += 1
+			while len(d.move_stack) > i:
+				d.pop()
+				keys.pop()
+			last = mv
+			for x in mv[i:]:
+				try:
+					m = d.parse_san(x)
+				except ValueError:
+					#print("# Illegal book move", x)
+					break
+				sm = BOOK.setdefault(keys[-1], [])
+				if m.uci() not in sm:
+					sm.append(m.uci())
+				d.push(m)
+				keys.append(zobrist_hash(d))
+			else:
+				ECO.setdefault(keys[-1], (eco, name))
+
+def getopen(b):
+	"Get the book moves for a board (the index is built on the first call)"
+	if BOOK is None:
+		readbook()
+	#print('# %s %s' % ECO.get(zobrist_hash(b), ('', '')))
+	return BOOK.get(zobrist_hash(b), [])
 
 def setendtime():
-	"Set system time to finish move computation at"
-	global endtime, movestogo
+	"Set the system times to finish move computation at"
+	global endtime, softtime, timeout, movestogo
 
+	timeout = False
 	if movetime > 0:
-		endtime = time.time() + movetime / 1000.
+		endtime = softtime = time.time() + movetime / 1000.
 		return
 	if wtime < 0 and btime < 0:
 	#	endtime = time.time() + 3		# 3 seconds default move time
+		endtime = softtime = time.time() + 1e8	# (no limit from an earlier move)
 		return
 	if movestogo < 0:
 		movestogo = 60
@@ -212,11 +272,12 @@ def setendtime():
 		thetime = wtime / 1000.
 	else:
 		thetime = btime / 1000.
-	endtime = time.time() + thetime / (movestogo + 3)
+	softtime = time.time() + thetime / (movestogo + 3)
+	endtime = time.time() + min(HARDTIME * thetime / (movestogo + 3), thetime / 2)
 
 def getmove(b, silent = False, usebook = True):
 	"Get value and primary variation for board"
-	global COMPC, PLAYC, MAXPLIES, PV, NODES, searchok
+	global COMPC, PLAYC, MAXPLIES, PV, PVMOVES, PVT, PVLEN, ROOT, KILLERS, HISTORY, NODES, MAT, REP, STATS, searchok, softtime
 
 	if b.turn == c.WHITE:
 		COMPC = c.WHITE
@@ -228,6 +289,8 @@ def getmove(b, silent = False, usebook = True):
 	if not silent:
 		print("FEN:", b.fen())
 
+	STATS = stats.new()
+	t0 = time.time()
 	try:
 		if usebook and USEBOOK:
 			opening = getopen(b)
@@ -235,7 +298,12 @@ def getmove(b, silent = False, usebook = True):
 				return 0, [choice(opening)]
 	except:
 		pass
+	t0 = stats.phase(STATS, 'book', t0)
 	NODES = 0
+	KILLERS, HISTORY = {}, 4096 * [0]
+	PVMOVES = set(PV)
+	n = max(DEPTH, 2) + QPLIES + 1	# (longest line: search depth and quiescence plies)
+	PVT, PVLEN, ROOT = [n * [None] for i in range(n)], (n + 1) * [-1], len(b.move_stack)
 	aa, ab = -1e6, 1e6	# initial alpha and beta
 
 	start = time.time()
@@ -250,30 +318,52 @@ def getmove(b, silent = False, usebook = True):
 	if not b.is_check() and not lastboard.is_check():
 		d = b.copy()
 		d.turn = not d.turn
-		t, enemyPV = searchmax(d, 2, -1e6, 1e6)
-		t = -t
+		# (the null-move search still uses Board.result(): it takes back and replays the last moves,
+		#   which also gives the move back to the side to move on b)
+		MAT, REP = material.count(d), None
+		t = -searchmax(d, 2, -1e6, 1e6)
 		if t > 1:
 			ab = t  + .5
+	t0 = stats.phase(STATS, 'null', t0)
 	setendtime()	# set end time for computation based on time control
 
+	depth = 0
 	for MAXPLIES in range(1, DEPTH):	# iterative deepening loop
+		if depth:
+			# do not start an iteration that would probably not be finished in time,
+			#   assuming that it takes as many times longer than the last one as that one did than the one before
+			now = time.time()
+			if now >= softtime or now + dt * (dn / dn0 if dn0 else 1) > endtime:
+				break
+		t1, n1 = time.time(), NODES
+		newPV = None
 		while time.time() < endtime and NODES < MAXNODES:
 			searchok = True
-			t, newPV = searchmax(b.copy(), MAXPLIES, aa, ab)
-			newPV = newPV[len(b.move_stack):]	# separate principal variation from moves already played
+			MAT, REP = material.count(b), draws.start(b)
+			t = searchmax(b.copy(), MAXPLIES, aa, ab)
+			newPV = PVT[0][:PVLEN[0]] if PVLEN[0] > 0 else []
 			if newPV:
 				break		# search has been successful
 			else:
 				ab += 10	# increase Beta if search fails and try again
+		if newPV is None:	# out of time or nodes before this iteration was started
+			break
 		# if search is succesful and complete, then update PV:
 		if searchok:
+			if depth and newPV and PV and newPV[0] != PV[0]:	# best move changed, so take more time for this move
+				softtime = min(start + EXTEND * (softtime - start), endtime)
+			dn0, dn, dt = (dn if depth else 0), NODES - n1, time.time() - t1
 			PV = newPV
+			PVMOVES = set(PV)
+			depth = MAXPLIES
 			print('info depth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES, 100 * t,
-				1000 * (time.time() - start), NODES, ' '.join(PV)))
+				1000 * (time.time() - start), NODES, ' '.join(x.uci() for x in PV)))
 			sys.stdout.flush()
 			if PV and (t < -500 or t > 500):	# found a checkmate
 				break
-	return t, PV
+	stats.phase(STATS, 'search', t0)
+	stats.info(STATS, NODES, depth, 'Newt')
+	return t, [x.uci() for x in PV]
 
 if __name__ == '__main__':
 	while True:	# game loop
@@ -3,6 +3,9 @@
 # A Python chess engine based on Plankalkül (1948) by Konrad Zuse
 
 import chess as c
+import material
+import stats
+import rootsplit
 import sys, math, time
 from random import random
 
@@ -12,33 +15,44 @@ COMPC = c.BLACK
 PLAYC = c.WHITE
 
 MAXPLIES = 3	# maximum search depth
+THREADS  = 1	# number of processes searching the root moves (see rootsplit.py)
+PARAMS   = 'COMPC', 'PLAYC', 'MAXPLIES'	# globals needed by searchroot()
 
 b = c.Board()
 NODES = 0
-
-def getval(b):
-	"Get total piece value of board"
+STATS = stats.new()	# statistics of the current search
+MAT = []	# piece counts of the current search position
+
+def getval(b, n = None):
+	"Get total piece value of board (n: piece counts, if they are already known)"
+	if n is None:
+		n = material.count(b)
+	wn, bn = n[c.WHITE], n[c.BLACK]
 	return (
-		len(b.pieces(c.PAWN, c.WHITE))          - len(b.pieces(c.PAWN, c.BLACK))
-	+	2 * (len(b.pieces(c.KNIGHT, c.WHITE))   - len(b.pieces(c.KNIGHT, c.BLACK)))
-	+	2 * (len(b.pieces(c.BISHOP, c.WHITE))   - len(b.pieces(c.BISHOP, c.BLACK)))
-	+	3 * (len(b.pieces(c.ROOK, c.WHITE))     - len(b.pieces(c.ROOK, c.BLACK)))
-	+	4 * (len(b.pieces(c.QUEEN, c.WHITE))    - len(b.pieces(c.QUEEN, c.BLACK)))
+		wn[c.PAWN]        - bn[c.PAWN]
+	+	2 * (wn[c.KNIGHT] - bn[c.KNIGHT])
+	+	2 * (wn[c.BISHOP] - bn[c.BISHOP])
+	+	3 * (wn[c.ROOK]   - bn[c.ROOK])
+	+	4 * (wn[c.QUEEN]  - bn[c.QUEEN])
 	)
 
 # https://chessprogramming.org/Alpha-Beta
 def searchmax(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, MAT
 
 	NODES += 1
+	if ply == 0:	# new search tree
+		MAT = material.count(b)
 	if ply >= MAXPLIES:
-		return getval(b)
-	for x in order(b, ply):
-		b.push(x)
+		STATS['evals'] += 1
+		return getval(b, MAT)
+	for i, x in enumerate(order(b, ply)):
+		material.push(MAT, b, x)
 		t = searchmin(b, ply + 1, alpha, beta)
-		b.pop()
+		material.pop(MAT, b)
 		if t >= beta:
+			stats.cutoff(STATS, i)
 			return beta
 		if t > alpha:
 			alpha = t
@@ -46,16 +60,20 @@ def searchmax(b, ply, alpha, beta):
 
 def searchmin(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, MAT
 
 	NODES += 1
+	if ply == 0:	# new search tree
+		MAT = material.count(b)
 	if ply >= MAXPLIES:
-		return getval(b)
-	for x in order(b, ply):
-		b.push(x)
+		STATS['evals'] += 1
+		return getval(b, MAT)
+	for i, x in enumerate(order(b, ply)):
+		material.push(MAT, b, x)
 		t = searchmax(b, ply + 1, alpha, beta)
-		b.pop()
+		material.pop(MAT, b)
 		if t <= alpha:
+			stats.cutoff(STATS, i)
 			return alpha
 		if t < beta:
 			beta = t
@@ -87,12 +105,25 @@ def pm():
 	else:
 		return -1
 
+def searchroot(b, x):
+	"Search root move x, return (move, score)"
+	t0 = time.time()
+	b.push(x)
+	if COMPC == c.WHITE:
+		t = searchmin(b, 0, -1e6, 1e6)
+	else:
+		t = searchmax(b, 0, -1e6, 1e6)
+	stats.phase(STATS, 'search', t0)
+	b.pop()
+	return x, t
+
 def getmove(b, silent = False, usebook = False):
 	"Get move list for board"
-	global COMPC, PLAYC, MAXPLIES, NODES
+	global COMPC, PLAYC, MAXPLIES, NODES, STATS
 
 	ll = []
 	NODES = 0
+	STATS = stats.new()
 
 	if b.turn == c.WHITE:
 		COMPC = c.WHITE
@@ -109,17 +140,11 @@ def getmove(b, silent = False, usebook = False):
 	nl = len(list(b.legal_moves))
 
 	start = time.time()
-	for n, x in enumerate(b.legal_moves):
-		b.push(x)
-		p = random()
-		if COMPC == c.WHITE:
-			t = searchmin(b, 0, -1e6, 1e6)
-		else:
-			t = searchmax(b, 0, -1e6, 1e6)
+	for n, (x, t) in enumerate(rootsplit.search(sys.modules[__name__], b, list(b.legal_moves))):
+		p = random()	# (drawn here, so that worker processes do not all draw the same numbers)
 		if not silent:
 			print("(%u/%u) %s %.1f %.2f" % (n + 1, nl, x, p, t))
 		ll.append((x, p, t))
-		b.pop()
 
 	ll.sort(key = lambda m: m[1] + 1000 * m[2])
 	if COMPC == c.WHITE:
@@ -127,6 +152,7 @@ def getmove(b, silent = False, usebook = False):
 	print('# %.2f %s' % (ll[0][1] + ll[0][2], [str(ll[0][0])]))
 	print('info depth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1,
 		100 * pm () * ll[0][2], 1000 * (time.time() - start), NODES, str(ll[0][0])))
+	stats.info(STATS, NODES, MAXPLIES + 1, 'Plan')
 	return ll[0][1] + ll[0][2], [str(ll[0][0])]
 
 if __name__ == '__main__':
@@ -1,55 +1,399 @@
 # PyTuroChamp worker processes
+# (they work with every multiprocessing start method and are only started by the first search)
 
 import pyturochamp as ptc
+import sharedtt, stats
 import chess as c
-from multiprocessing import Queue, Process, cpu_count, set_start_method
-from queue import Empty, Full
+import sys, time
+from multiprocessing import get_context, cpu_count
+from multiprocessing.connection import Listener, Client
+from threading import Thread
+from queue import Queue, Empty, Full
 
-# needed for Python 3.14 and later:
-set_start_method("fork")
+METHOD = None	# multiprocessing start method for the workers ('fork', 'forkserver' or 'spawn'), None = platform default
+LISTEN = None	# (host, port) on which network workers are accepted (see the end of this file), None = none
+AUTHKEY = b''	# shared secret of the coordinator and its network workers (tasks are pickled, so set a good one)
+RETRY = 5	# seconds before a network worker tries to connect to the coordinator again
 
-def worker():
+SHARED = None	# shared transposition table of the current Lazy SMP search
+JOB = None	# number of the current job (in shared memory), older tasks are dropped or stopped
+CURRENT = 0	# job of the task that this worker process is running
+K = 0		# number of this worker process
+AHEAD = 2	# number of tasks that are given to a worker at a time
+num_w = 0	# number of worker processes
+procs = []	# the process of each worker, None for network workers
+queues = []	# query queue of each worker
+pending = []	# tasks waiting for each worker
+busy = []	# number of unfinished tasks given to each worker
+alive = []	# is each worker still running?
+sent = []	# tasks sent to each network worker without a result yet
+joined = []	# connections of network workers that join() has not added yet
+listener = None	# for network workers
+
+def encode(b, history = True):
+	"Compact form of a board for the task queue: FEN, UCI moves since then and Chess960 flag"
+	# only the moves since the last capture or pawn move matter (for draw claims)
+	if history:
+		r = b.copy(stack = b.halfmove_clock)
+		return r.root().fen(), ' '.join(m.uci() for m in r.move_stack), b.chess960
+	return b.fen(), '', b.chess960
+
+def decode(fen, moves, chess960):
+	"Get board from encode() output"
+	b = c.Board(fen, chess960 = chess960)
+	for m in moves.split():
+		b.push_uci(m)
+	return b
+
+def movekey(x):
+	"Affinity key for root move x: the same move is searched by the same worker in the following searches"
+	# (its subtree then has transpositions to the one searched before, e.g. after two more plies)
+	return 64 * x.from_square + x.to_square
+
+def bycost(b, moves, nodes):
+	"Sort root moves on board b by their estimated search cost, most expensive first"
+	# nodes: the nodes that moves (UCI) took in the last search; the others are guessed from
+	#   captures, checks and the captures after them, scaled to the known ones
+	guess = {}
+	for x in moves:
+		h = 1 + 2 * b.is_capture(x) + 2 * b.gives_check(x)
+		b.push(x)
+		for y in b.generate_legal_captures():	# quiescence fan-out
+			h += 1
+		b.pop()
+		guess[x] = h
+	known = [x for x in moves if x.uci() in nodes]
+	f = sum(nodes[x.uci()] for x in known) / sum(guess[x] for x in known) if known else 1
+	return sorted(moves, key = lambda x: -nodes.get(x.uci(), f * guess[x]))
+
+def setparams(compc, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH):
+	"Set the search parameters of the engine in this process"
+	ptc.MAXPLIES = MAXPLIES
+	ptc.QPLIES = QPLIES
+	ptc.PSTAB = PSTAB
+	ptc.PDEAD = PDEAD
+	ptc.MATETEST = MATETEST
+	ptc.HASH = HASH
+	if compc == c.WHITE:
+		ptc.COMPC = c.WHITE
+		ptc.PLAYC = c.BLACK
+	else:
+		ptc.COMPC = c.BLACK
+		ptc.PLAYC = c.WHITE
+
+def evaluate(b, x, lastpos, compc, cr0):
+	"Evaluate root move x on board b, return (move, positional value, score, nodes, statistics, expected reply) or None if stopped"
+	ptc.NODES = 0
+	ptc.STATS = stats.new()
+	t0 = time.time()
+	if b.is_castling(x):		# are we castling now?
+		castle = ptc.pm()
+	else:
+		castle = 0
+	b.push(x)
+	p = ptc.getpos(b) - lastpos + castle
+	cr = b.has_castling_rights(compc)
+	if cr0 == True and cr == True:	# can we still castle later?
+		p += ptc.pm()
+	for y in b.legal_moves:
+		if b.is_castling(y):	# can we castle in the next move?
+			p += ptc.pm()
+	t0 = stats.phase(ptc.STATS, 'pos', t0)
+
+	ptc.canstop, ptc.searchok = True, True	# (see ptc.timeup())
+	if compc == c.WHITE:
+		t = ptc.searchmin(b, 0, -1e6, 1e6)
+	else:
+		t = ptc.searchmax(b, 0, -1e6, 1e6)
+	stats.phase(ptc.STATS, 'search', t0)
+	b.pop()
+	if not ptc.searchok:
+		return None
+	ptc.canstop = False
+	return x, p, t, ptc.NODES, ptc.STATS, ptc.REPLY
+
+def task(fen, moves, chess960, x, lastpos, compc, cr0, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH):
+	"Evaluate root move x (in UCI notation) on board from encode(), with the own table of this process"
+	b = decode(fen, moves, chess960)
+	setparams(compc, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH)
+	# (the table is kept between tasks, older entries are replaced first)
+	ptc.SHARED, ptc.REVERSE, ptc.TTAGE = None, False, CURRENT
+	return evaluate(b, b.parse_uci(x), lastpos, compc, cr0)
+
+def replytask(fen, moves, chess960, x, t, y, compc, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH):
+	"Get the expected reply to root move x (UCI) with score t, see ptc.expected() (y: the reply from evaluate() in UCI notation or '')"
+	b = decode(fen, moves, chess960)
+	setparams(compc, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH)
+	ptc.SHARED, ptc.REVERSE, ptc.TTAGE = None, False, CURRENT
+	ptc.canstop, ptc.searchok = True, True
+	r = ptc.expected(b, b.parse_uci(x), t, c.Move.from_uci(y) if y else None)
+	ptc.canstop = False
+	if not ptc.searchok:
+		return None
+	return (r.uci() if r else None,)	# (a tuple, so that get() also passes on None)
+
+def smptask(fen, moves, chess960, k, n, lastpos, compc, cr0, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH, name):
+	"Lazy SMP: evaluate all root moves, starting with the k-th of n parts of the move list, with a shared table"
+	global SHARED
+
+	b = decode(fen, moves, chess960)
+	setparams(compc, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH)
+	if not SHARED or SHARED.name != name:
+		if SHARED:
+			SHARED.close()
+		SHARED = sharedtt.attach(name)
+	ptc.SHARED, ptc.TTAGE = SHARED, CURRENT
+	ptc.REVERSE = k % 2 == 1	# processes that start on the same move search its subtree differently
+	ml = list(b.legal_moves)
+	i = k * len(ml) // n
+	for x in ml[i:] + ml[:i]:
+		r = evaluate(b, x, lastpos, compc, cr0)
+		if not r:
+			return
+		urlr.put((K, CURRENT, r, False))
+
+def stopped():
+	"Has the task that this worker process is running been cancelled?"
+	return JOB.value != CURRENT
+
+def run(f, args):
+	"Run task f(*args), return its result or None if it was cancelled"
+	r = None
+	if not stopped():	# (tasks of earlier jobs are dropped)
+		r = f(*args)
+		if ptc.STOP():
+			r = None
+	return r
+
+def worker(k, q, r, job):
+	"Run the tasks from query queue q of worker k and put their results into result queue r"
+	global K, urlq, urlr, JOB, CURRENT
+
+	K, urlq, urlr, JOB = k, q, r, job	# (not inherited with the spawn and forkserver start methods)
+	ptc.STOP = stopped
 	while True:
 		try:
-			b, x, lastpos, compc, cr0, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST = urlq.get()
+			CURRENT, f, args = urlq.get()
 		except:
 			pass
 		else:
-			ptc.MAXPLIES = MAXPLIES
-			ptc.QPLIES = QPLIES
-			ptc.PSTAB = PSTAB
-			ptc.PDEAD = PDEAD
-			ptc.MATETEST = MATETEST
-			if compc == c.WHITE:
-				ptc.COMPC = c.WHITE
-				ptc.PLAYC = c.BLACK
-			if b.is_castling(x):		# are we castling now?
-				castle = ptc.pm()
-			else:
-				castle = 0
-			b.push(x)
-			p = ptc.getpos(b) - lastpos + castle
-			cr = b.has_castling_rights(compc)
-			if cr0 == True and cr == True:	# can we still castle later?
-				p += ptc.pm()
-			for y in b.legal_moves:
-				if b.is_castling(y):	# can we castle in the next move?
-					p += ptc.pm()
-
-			if compc == c.WHITE:
-				t = ptc.searchmin(b, 0, -1e6, 1e6)
-			else:
-				t = ptc.searchmax(b, 0, -1e6, 1e6)
-			urlr.put((x, p, t))
-
-def start():
-	global num_worker_threads, urlq, urlr, new_data, program_run, ti
-	num_w = cpu_count()	# determine number of worker processes automatically
-	urlq = Queue()		# query queue
-	urlr = Queue()		# result queue
-
-	for i in range(num_w):
-		ti = Process(target=worker)
+			urlr.put((K, CURRENT, run(f, args), True))	# (this also tells get() that the task is finished)
+
+def remotestopped():
+	"Like stopped(), for a network worker: new job numbers come from the coordinator"
+	while conn.poll():
+		t = conn.recv()
+		if t[1]:	# a task (the coordinator may send the next one while this one runs)
+			inbox.append(t)
+		else:
+			JOB.value = t[0]
+	return stopped()
+
+def serve(address, authkey):
+	"Network worker: run the tasks of the coordinator at address (see LISTEN) until the connection is lost"
+	global JOB, CURRENT, conn, inbox
+
+	conn = Client(address, authkey = authkey)
+	JOB = get_context().RawValue('i', 0)
+	inbox = []
+	ptc.STOP = remotestopped
+	while True:
+		if inbox:
+			CURRENT, f, args = inbox.pop(0)
+		else:
+			CURRENT, f, args = conn.recv()
+		if not f:	# (job number, None, None): number of the current job
+			JOB.value = CURRENT
+			continue
+		conn.send((CURRENT, run(f, args), True))
+
+def remote(address, authkey):
+	"Keep a network worker running, connect again after the coordinator has gone away"
+	while True:
+		try:
+			serve(address, authkey)
+		except (OSError, EOFError):
+			pass
+		time.sleep(RETRY)
+
+def accept():
+	"Accept network workers (thread of the coordinator), they are added to the pool by join()"
+	while True:
+		try:
+			joined.append(listener.accept())
+		except Exception:	# (e.g. wrong authkey)
+			pass
+
+def join():
+	"Add the network workers that have connected to the pool"
+	while joined:
+		c = joined.pop(0)
+		k = len(queues)
+		q = Queue()
+		queues.append(q)
+		procs.append(None)
+		pending.append([])
+		busy.append(0)
+		alive.append(True)
+		sent.append([])
+		q.put((JOB.value, None, None))
+		for f in (sender, receiver):
+			t = Thread(target = f, args = (k, c))
+			t.daemon = True
+			t.start()
+
+def sender(k, c):
+	"Send the tasks for network worker k over connection c (thread of the coordinator)"
+	q = queues[k]
+	while True:
+		t = q.get()
+		if t[1]:
+			sent[k].append(t)	# (until the result comes back)
+		try:
+			c.send(t)
+		except (OSError, ValueError):	# receiver() reports this
+			return
+
+def receiver(k, c):
+	"Pass on the results of network worker k from connection c (thread of the coordinator)"
+	while True:
+		try:
+			j, r, done = c.recv()
+		except (OSError, EOFError):
+			break
+		if done:
+			sent[k].pop(0)	# (the tasks are run in order)
+		urlr.put((k, j, r, done))
+	c.close()
+	urlr.put((k, None, sent[k], None))	# get() gives its unfinished tasks to other workers
+
+def lost(k, tasks):
+	"Give the tasks of network worker k, which has gone away, to the other workers"
+	alive[k] = False
+	busy[k] = 0
+	try:
+		while True:
+			tasks.append(queues[k].get_nowait())	# (not sent yet)
+	except Empty:
+		pass
+	tasks += pending[k]
+	pending[k] = []
+	for t in tasks:
+		if t[0] == JOB.value and t[1]:
+			submit(t[0], t[1], *t[2])
+
+def newjob():
+	"Cancel all tasks and return the number of a new job"
+	cancel()
+	return JOB.value
+
+def cancel():
+	"Drop the tasks in the queue and stop the running ones"
+	if not num_w:	# no workers started yet
+		return
+	JOB.value += 1
+	for k in range(len(queues)):
+		del pending[k][:]
+		if alive[k] and not procs[k]:	# network workers do not see JOB
+			queues[k].put((JOB.value, None, None))
+	urlr.put((None, None, None, False))	# wake up get()
+
+def workers():
+	"Get the numbers of the running workers, local processes first"
+	join()
+	return ([k for k in range(len(queues)) if alive[k] and procs[k]]
+		+ [k for k in range(len(queues)) if alive[k] and not procs[k]])
+
+def submit(job, f, *args, key = None):
+	"Add task f(*args) of job, for worker key % workers if possible (e.g. for a warm table there)"
+	# (without a key, the worker with the fewest tasks is used; key < number of worker processes
+	#   always gives a local process, which Lazy SMP tasks need)
+	ww = workers()
+	if key is None:
+		k = min(ww, key = lambda i: len(pending[i]) + busy[i])
+	else:
+		k = ww[key % len(ww)]
+	pending[k].append((job, f, args))
+	dispatch()
+
+def dispatch():
+	"Give waiting tasks to the workers with less than AHEAD tasks, first their own ones, then those of others"
+	ww = workers()
+	for k in ww:
+		while busy[k] < AHEAD and pending[k]:
+			queues[k].put(pending[k].pop(0))
+			busy[k] += 1
+	for k in ww:
+		while busy[k] < AHEAD:
+			# (the task that worker j would get last; Lazy SMP tasks only for local processes)
+			jj = [j for j in ww if pending[j] and (procs[k] or pending[j][-1][1] is not smptask)]
+			if not jj:
+				break
+			j = max(jj, key = lambda i: len(pending[i]))
+			queues[k].put(pending[j].pop())
+			busy[k] += 1
+
+def get(job, timeout = None):
+	"Get the next result of job (None if it was cancelled), raise Empty if there is none within timeout seconds"
+	while True:
+		if JOB.value != job:
+			return None
+		k, j, r, done = urlr.get(timeout = timeout)
+		if done is None:	# a network worker has gone away
+			lost(k, r)
+			continue
+		if done and alive[k]:
+			busy[k] -= 1
+			dispatch()
+		if j == job and r:
+			return r
+
+def start(n = 0):
+	"Start n worker processes (0 = one per CPU), or change the number of running ones to n"
+	global urlr, num_w, listener, JOB
+	if not n:
+		n = cpu_count()	# determine number of worker processes automatically
+	if n == num_w:
+		return
+	ctx = get_context(METHOD)
+	if ctx.get_start_method() == 'forkserver':	# new workers are forked with the engine already imported
+		ctx.set_forkserver_preload(['ptc_worker'])
+	if JOB is None:
+		JOB = ctx.RawValue('i', 0)
+	for k in range(len(queues)):	# (new queues, as stopped processes may leave the old ones locked)
+		if procs[k] and alive[k]:
+			procs[k].terminate()
+			alive[k] = False
+			pending[k] = []
+		busy[k] = 0	# (the results of network workers may have been in the old result queue)
+	urlr = ctx.Queue()	# result queue
+	num_w = n
+	for i in range(num_w):	# (worker numbers are not used again, so late messages cannot be mixed up)
+		k = len(queues)
+		queues.append(ctx.Queue())	# query queue
+		pending.append([])
+		busy.append(0)
+		alive.append(True)
+		sent.append([])
+		ti = ctx.Process(target=worker, args=(k, queues[k], urlr, JOB))
 		ti.daemon = True
 		ti.start()
+		procs.append(ti)
+	if LISTEN and not listener:
+		if not AUTHKEY:
+			raise ValueError("ptc_worker.AUTHKEY must be set for network workers")
+		listener = Listener(LISTEN, authkey = AUTHKEY)
+		t = Thread(target = accept)
+		t.daemon = True
+		t.start()
 
+if __name__ == '__main__':
+	# network worker: python3 ptc_worker.py host port authkey [processes]
+	# (on another machine with the same files; processes: 0 = one per CPU)
+	address = sys.argv[1], int(sys.argv[2])
+	n = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+	import ptc_worker	# (the tasks refer to this module, not to __main__)
+	ctx = get_context(METHOD)
+	for i in range(n or cpu_count()):
+		ti = ctx.Process(target=ptc_worker.remote, args=(address, sys.argv[3].encode()))
+		ti.start()
@@ -9,9 +9,11 @@
 
 from __future__ import print_function
 
-import sys, datetime
+import sys, os, datetime, threading
 import chess as c
 import chess.pgn
+from queue import Queue
+import stats
 
 abc = "abcdefgh"
 nn  = "12345678"
@@ -82,14 +84,11 @@ else:
 
 p.Chess960 = False    # Chess960 mode off by default
 
-try:
-	log = open(lf, 'w')
-except:
-	log = ''
-	print("# Could not create log file")
+log = ''
 
 def print2(x):
 	print(x)
+	sys.stdout.flush()	# (input() did this before reading the next command)
 	if log:
 		log.write("< %s\n" % x)
 		log.flush()
@@ -100,7 +99,9 @@ r = ''
 def move(r):
 	rm = r[0]
 	d.push_uci(rm)
-	if is_uci:
+	if is_uci and getattr(p, 'PONDERMOVE', None):	# (the GUI can then ponder on this reply)
+		print2("bestmove %s ponder %s" % (rm, p.PONDERMOVE))
+	elif is_uci:
 		print2("bestmove %s" % rm)
 	else:
 		print2("move %s" % rm)
@@ -142,7 +143,10 @@ def fromfen(fen):
 		print2("Bad FEN")
 	#print(d)
 
-def set_newt_time(line):
+def set_time(line):
+	p.wtime, p.btime, p.movestogo, p.movetime = -1, -1, -1, -1
+	if nm == 'PyTuroChamp':	# (PyTuroChamp has no maxnodes option, so only "go nodes" sets a node limit)
+		p.MAXNODES = 0
 	xx = line.split()
 	for x in range(len(xx)):
 		if xx[x] == 'wtime':
@@ -156,246 +160,308 @@ def set_newt_time(line):
 		if xx[x] == 'nodes':
 			p.MAXNODES = int(xx[x + 1])
 
-while True:
-	l = ''
-	try:
-		if sys.version < '3':
-			l = raw_input()
-		else:
-			l = input()
-	except KeyboardInterrupt:	# XBoard sends Control-C characters, so these must be caught
-		if not is_uci:
-			pass		#   Otherwise Python would quit.
-	if l:
+def reader():
+	"Read the commands in a thread of their own, so that a search can be stopped at once"
+	# (not from sys.stdin itself: new worker processes close it, which would hang while it is being read here)
+	for l in os.fdopen(os.dup(sys.stdin.fileno())):
+		l = l.rstrip('\r\n')
+		if l == 'stop' and hasattr(p, 'stop'):	# (getmove() then returns and the move is sent)
+			p.stop()
+		elif l.split()[:1] == ['go'] and hasattr(p, 'go'):	# (here, so that a stop that follows is never before it)
+			p.go()
+		lines.put(l)
+	lines.put('quit')
+
+def waitponder():
+	"After a search in ponder mode, wait until the opponent has played the expected move or the search is stopped"
+	# (the search may also be finished before; the move must only be sent after ponderhit or stop)
+	while True:
+		l = lines.get()
 		if log:
 			log.write(l + '\n')
 			log.flush()
-		if l == 'xboard':
-			print2('feature myname="%s" setboard=1 done=1' % nm)
+		if l in ('ponderhit', 'stop'):
+			return
+		if l == 'isready':
+			print2("readyok")
 		elif l == 'quit':
 			sys.exit(0)
-		elif l == 'new':
-			newgame()
-		elif l == 'uci':
-			is_uci = True
-			print2("id name %s" % nm)
-			print2("id author Martin C. Doege")
-			if 'PyTuroChamp' in nm:
-				print2("option name maxplies type spin default 1 min 0 max 1024")
-				print2("option name qplies type spin default 7 min 0 max 1024")
-				print2("option name pstab type spin default 0 min 0 max 1024")
-				print2("option name matetest type check default true")
-
-				print2("option name MoveError type spin default 0 min 0 max 1024")
-				print2("option name BlunderError type spin default 0 min 0 max 1024")
-				print2("option name BlunderPercent type spin default 0 min 0 max 1024")
-
-				print2("option name EasyLearn type spin default 0 min 0 max 1024")
-				print2("option name EasyLambda type spin default 20 min 1 max 1024")
-
-				print2("option name PlayerAdvantage type spin default 0 min -1024 max 1024")
-			if nm == 'Bare':
-				print2("option name maxplies type spin default 3 min 0 max 1024")
-				print2("option name pstab type spin default 5 min 0 max 1024")
-				print2("option name matetest type check default true")
-			if nm == 'Shannon':
-				print2("option name maxplies type spin default 1 min 0 max 1024")
-				print2("option name qplies type spin default 7 min 0 max 1024")
-				print2("option name matetest type check default true")
-				print2("option name pawnrule type check default false")
-			if nm == 'Plan':
-				print2("option name maxplies type spin default 3 min 0 max 1024")
-			if nm == 'Newt':
-				print2("option name depth type spin default 4 min 0 max 1024")
-				print2("option name qplies type spin default 6 min 0 max 1024")
-				print2("option name pstab type spin default 1 min 0 max 1024")
-				print2("option name maxnodes type spin default 1000000 min 0 max 1000000000")
-				print2("option name usebook type check default true")
-				print2("option name matetest type check default true")
-			if nm == 'SOMA':
-				print2("option name matetest type check default true")
-			if nm == 'Bernstein':
-				print2("option name maxplies type spin default 3 min 0 max 1024")
-				print2("option name pmtlen type spin default 7 min 1 max 1024")
-				print2("option name pmtstart type spin default 0 min 0 max 1024")
-				print2("option name matetest type check default true")
-			if nm == 'Simple Adaptive Engine':
-				print2("option name nummov type spin default 20 min 1 max 1024")
-				print2("option name mtime type spin default 3 min 1 max 1024")
-				print2("option name ev type spin default 100 min -1024 max 1024")
-				print2("option name alim type spin default 200 min 0 max 1024")
-				print2("option name lambda type spin default 10 min 1 max 1024")
-				print2("option name enginepath type string default stockfish")
-				print2("option name trueval type check default true")
-				print2("option name usebook type check default true")
-				print2("option name bookpath type string default Elo2400.bin")
-				print2("option name waitbook type check default true")
-
-			if nm != 'Simple Adaptive Engine':
-				print2("option name UCI_Chess960 type check default false")
-			print2("uciok")
-		elif l == 'ucinewgame':
-			newgame()
-		elif 'position startpos moves' in l:
-			mm = l.split()[3:]
-			newgame()
-			for mo in mm:
-				d.push_uci(mo)
-		elif 'position fen' in l:
-			if l.split()[6] == 'moves':	# Shredder FEN
-				l = ' '.join(l.split()[:6] + ['0', '1'] + l.split()[6:])
-			ff = l.split()[2:8]
-			mm = l.split()[9:]
-			ff = ' '.join(ff)
-			if d:
-				old = d.copy()
-				fromfen(ff)
-				# Test if new position continues the current game.
-				# In that case, do not discard the current game but append the new moves.
-				if old.fen() == ff:
-					for mo in mm:
-						old.push_uci(mo)
-					d = old.copy()
-				else:
-					for mo in mm:
-						d.push_uci(mo)
-			else:
-				fromfen(ff)
-				for mo in mm:
-					d.push_uci(mo)
-		elif 'setoption name maxplies value' in l:
-			p.MAXPLIES = int(l.split()[4])
-			print2("# maxplies: %u" % p.MAXPLIES)
-		elif 'setoption name depth value' in l:
-			p.DEPTH = int(l.split()[4])
-			print2("# depth: %u" % p.DEPTH)
-		elif 'setoption name qplies value' in l:
-			p.QPLIES = int(l.split()[4])
-			print2("# qplies: %u" % p.QPLIES)
-		elif 'setoption name nummov value' in l:
-			p.NUMMOV = int(l.split()[4])
-			print2("# nummov: %u" % p.NUMMOV)
-		elif 'setoption name mtime value' in l:
-			p.MTIME = int(l.split()[4])
-			print2("# mtime: %u" % p.MTIME)
-		elif 'setoption name ev value' in l:
-			p.EV = int(l.split()[4]) / 100.
-			print2("# ev: %u" % p.EV)
-		elif 'setoption name alim value' in l:
-			p.ALIM = int(l.split()[4]) / 100.
-			print2("# alim: %u" % p.ALIM)
-		elif 'setoption name lambda value' in l:
-			p.LAMBDA = int(l.split()[4]) / 10.
-			print2("# lambda: %u" % p.LAMBDA)
-		elif 'setoption name enginepath value' in l:
-			p.ENGINE = l.split()[4]
-			print2("# enginepath: %s" % p.ENGINE)
-		elif 'setoption name bookpath value' in l:
-			p.BOOKPATH = l.split()[4]
-			print2("# bookpath: %s" % p.BOOKPATH)
-		elif 'setoption name trueval value' in l:
-			if l.split()[4] == "true":
-				p.TRUEVAL = True
-			else:
-				p.TRUEVAL = False
-			print2("# trueval: %s" % p.TRUEVAL)
-		elif 'setoption name waitbook value' in l:
-			if l.split()[4] == "true":
-				p.WAITBOOK = True
-			else:
-				p.WAITBOOK = False
-			print2("# waitbook: %s" % p.WAITBOOK)
-		elif 'setoption name pstab value' in l:
-			if 'Bare' in nm or 'Newt' in nm:
-				p.PSTAB = int(l.split()[4]) / 10.	# convert to pawn units for Bare and Newt
-				print2("# pstab: %u" % p.PSTAB)
-			else:
-				p.PSTAB = int(l.split()[4])
-				print2("# pstab: %u" % p.PSTAB)
-		elif 'setoption name maxnodes value' in l:
-			p.MAXNODES = int(l.split()[4])
-			print2("# maxnodes: %u" % p.MAXNODES)
-		elif 'setoption name matetest value' in l:
-			if l.split()[4] == "true":
-				p.MATETEST = True
-			else:
-				p.MATETEST = False
-			print2("# matetest: %s" % p.MATETEST)
-		elif 'setoption name pawnrule value' in l:
-			if l.split()[4] == "true":
-				p.PAWNRULE = True
-			else:
-				p.PAWNRULE = False
-			print2("# pawnrule: %s" % p.PAWNRULE)
-		elif 'setoption name usebook value' in l:
-			if l.split()[4] == "true":
-				p.USEBOOK = True
-			else:
-				p.USEBOOK = False
-			print2("# usebook: %s" % p.USEBOOK)
-		elif 'setoption name pmtlen value' in l:
-			p.PMTLEN = int(l.split()[4])
-			print2("# pmtlen: %u" % p.PMTLEN)
-		elif 'setoption name pmtstart value' in l:
-			p.PMTSTART = int(l.split()[4])
-			print2("# pmtstart: %u" % p.PMTSTART)
-
-		elif 'setoption name MoveError value' in l:
-			p.MoveError = int(l.split()[4])
-			print2("# MoveError: %u" % p.MoveError)
-		elif 'setoption name BlunderError value' in l:
-			p.BlunderError = int(l.split()[4])
-			print2("# BlunderError: %u" % p.BlunderError)
-		elif 'setoption name BlunderPercent value' in l:
-			p.BlunderPercent = int(l.split()[4])
-			print2("# BlunderPercent: %u" % p.BlunderPercent)
-		elif 'setoption name EasyLearn value' in l:
-			p.EasyLearn = int(l.split()[4])
-			print2("# EasyLearn: %u" % p.EasyLearn)
-		elif 'setoption name EasyLambda value' in l:
-			p.EasyLambda = int(l.split()[4]) / 10.
-			print2("# EasyLambda: %u" % p.EasyLambda)
-		elif 'setoption name PlayerAdvantage value' in l:
-			p.PlayerAdvantage = int(l.split()[4])
-			print2("# PlayerAdvantage: %u" % p.PlayerAdvantage)
-		elif 'setoption name UCI_Chess960 value' in l:
-			if l.split()[4] == "true":
-				p.Chess960 = True
-			else:
-				p.Chess960 = False
-			print2("# UCI_Chess960: %s" % p.Chess960)
-		elif l == 'isready':
-			if not d:
-				newgame()
-			print2("readyok")
-		elif 'setboard' in l:
-			fen = l.split(' ', 1)[1]
-			fromfen(fen)
-		elif l[:2] == 'go' or l == 'force':
-			if not d:
-				newgame()
 
-			if nm == 'Newt':	# Newt has time management
-				set_newt_time(l)
+if __name__ == '__main__':	# (worker processes that are not forked import this file again)
+	try:
+		log = open(lf, 'w')
+	except:
+		log = ''
+		print("# Could not create log file")
+
+	lines = Queue()
+	t = threading.Thread(target = reader)
+	t.daemon = True
+	t.start()
 
-			t, r = p.getmove(d, silent = True)
-			if r:
-				move(r)
-		elif l == '?':
-			print2("move", r)
+	while True:
+		l = ''
+		try:
+			l = lines.get()
+		except KeyboardInterrupt:	# XBoard sends Control-C characters, so these must be caught
+			if not is_uci:
+				pass		#   Otherwise Python would quit.
+		if l:
 			if log:
-				log.write("move %s\n" % r)
+				log.write(l + '\n')
 				log.flush()
-		else:
-			if not d:
+			if l == 'xboard':
+				print2('feature myname="%s" setboard=1 done=1' % nm)
+			elif l == 'quit':
+				sys.exit(0)
+			elif l == 'new':
+				newgame()
+			elif l == 'uci':
+				is_uci = True
+				print2("id name %s" % nm)
+				print2("id author Martin C. Doege")
+				if 'PyTuroChamp' in nm:
+					print2("option name maxplies type spin default 1 min 0 max 1024")
+					print2("option name qplies type spin default 7 min 0 max 1024")
+					print2("option name pstab type spin default 0 min 0 max 1024")
+					print2("option name matetest type check default true")
+					print2("option name Hash type spin default 16 min 0 max 4096")
+
+					print2("option name MoveError type spin default 0 min 0 max 1024")
+					print2("option name BlunderError type spin default 0 min 0 max 1024")
+					print2("option name BlunderPercent type spin default 0 min 0 max 1024")
+
+					print2("option name EasyLearn type spin default 0 min 0 max 1024")
+					print2("option name EasyLambda type spin default 20 min 1 max 1024")
+
+					print2("option name PlayerAdvantage type spin default 0 min -1024 max 1024")
+				if nm == 'Bare':
+					print2("option name maxplies type spin default 3 min 0 max 1024")
+					print2("option name pstab type spin default 5 min 0 max 1024")
+					print2("option name matetest type check default true")
+				if nm == 'Shannon':
+					print2("option name maxplies type spin default 1 min 0 max 1024")
+					print2("option name qplies type spin default 7 min 0 max 1024")
+					print2("option name matetest type check default true")
+					print2("option name pawnrule type check default false")
+				if nm == 'Plan':
+					print2("option name maxplies type spin default 3 min 0 max 1024")
+				if nm == 'Newt':
+					print2("option name depth type spin default 4 min 0 max 1024")
+					print2("option name qplies type spin default 6 min 0 max 1024")
+					print2("option name pstab type spin default 1 min 0 max 1024")
+					print2("option name maxnodes type spin default 1000000 min 0 max 1000000000")
+					print2("option name usebook type check default true")
+					print2("option name matetest type check default true")
+				if nm == 'SOMA':
+					print2("option name matetest type check default true")
+				if nm == 'Bernstein':
+					print2("option name maxplies type spin default 3 min 0 max 1024")
+					print2("option name pmtlen type spin default 7 min 1 max 1024")
+					print2("option name pmtstart type spin default 0 min 0 max 1024")
+					print2("option name matetest type check default true")
+				if nm == 'Simple Adaptive Engine':
+					print2("option name nummov type spin default 20 min 1 max 1024")
+					print2("option name mtime type spin default 3 min 1 max 1024")
+					print2("option name ev type spin default 100 min -1024 max 1024")
+					print2("option name alim type spin default 200 min 0 max 1024")
+					print2("option name lambda type spin default 10 min 1 max 1024")
+					print2("option name enginepath type string default stockfish")
+					print2("option name trueval type check default true")
+					print2("option name usebook type check default true")
+					print2("option name bookpath type string default Elo2400.bin")
+					print2("option name waitbook type check default true")
+
+				if hasattr(p, 'THREADS'):
+					print2("option name Threads type spin default %d min 0 max 1024" % p.THREADS)
+				if hasattr(p, 'PONDERMOVE'):
+					print2("option name Ponder type check default false")
+				if hasattr(p, 'STATS'):
+					print2("option name StatsLog type string default <empty>")
+				if nm != 'Simple Adaptive Engine':
+					print2("option name UCI_Chess960 type check default false")
+				print2("uciok")
+			elif l == 'ucinewgame':
 				newgame()
-			if l[0] in abc and l[2] in abc and l[1] in nn and l[3] in nn:
-				if len(l) == 6:
-					l = l[:4] + 'q'	# "Knights" outputs malformed UCI pawn promotion moves
-				d.push_uci(l)
-				pgn()
+			elif 'position startpos moves' in l:
+				mm = l.split()[3:]
+				newgame()
+				for mo in mm:
+					d.push_uci(mo)
+			elif 'position fen' in l:
+				if l.split()[6] == 'moves':	# Shredder FEN
+					l = ' '.join(l.split()[:6] + ['0', '1'] + l.split()[6:])
+				ff = l.split()[2:8]
+				mm = l.split()[9:]
+				ff = ' '.join(ff)
+				if d:
+					old = d.copy()
+					fromfen(ff)
+					# Test if new position continues the current game.
+					# In that case, do not discard the current game but append the new moves.
+					if old.fen() == ff:
+						for mo in mm:
+							old.push_uci(mo)
+						d = old.copy()
+					else:
+						for mo in mm:
+							d.push_uci(mo)
+				else:
+					fromfen(ff)
+					for mo in mm:
+						d.push_uci(mo)
+			elif 'setoption name maxplies value' in l:
+				p.MAXPLIES = int(l.split()[4])
+				print2("# maxplies: %u" % p.MAXPLIES)
+			elif 'setoption name depth value' in l:
+				p.DEPTH = int(l.split()[4])
+				print2("# depth: %u" % p.DEPTH)
+			elif 'setoption name qplies value' in l:
+				p.QPLIES = int(l.split()[4])
+				print2("# qplies: %u" % p.QPLIES)
+			elif 'setoption name nummov value' in l:
+				p.NUMMOV = int(l.split()[4])
+				print2("# nummov: %u" % p.NUMMOV)
+			elif 'setoption name mtime value' in l:
+				p.MTIME = int(l.split()[4])
+				print2("# mtime: %u" % p.MTIME)
+			elif 'setoption name ev value' in l:
+				p.EV = int(l.split()[4]) / 100.
+				print2("# ev: %u" % p.EV)
+			elif 'setoption name alim value' in l:
+				p.ALIM = int(l.split()[4]) / 100.
+				print2("# alim: %u" % p.ALIM)
+			elif 'setoption name lambda value' in l:
+				p.LAMBDA = int(l.split()[4]) / 10.
+				print2("# lambda: %u" % p.LAMBDA)
+			elif 'setoption name enginepath value' in l:
+				p.ENGINE = l.split()[4]
+				print2("# enginepath: %s" % p.ENGINE)
+			elif 'setoption name bookpath value' in l:
+				p.BOOKPATH = l.split()[4]
+				print2("# bookpath: %s" % p.BOOKPATH)
+			elif 'setoption name trueval value' in l:
+				if l.split()[4] == "true":
+					p.TRUEVAL = True
+				else:
+					p.TRUEVAL = False
+				print2("# trueval: %s" % p.TRUEVAL)
+			elif 'setoption name waitbook value' in l:
+				if l.split()[4] == "true":
+					p.WAITBOOK = True
+				else:
+					p.WAITBOOK = False
+				print2("# waitbook: %s" % p.WAITBOOK)
+			elif 'setoption name pstab value' in l:
+				if 'Bare' in nm or 'Newt' in nm:
+					p.PSTAB = int(l.split()[4]) / 10.	# convert to pawn units for Bare and Newt
+					print2("# pstab: %u" % p.PSTAB)
+				else:
+					p.PSTAB = int(l.split()[4])
+					print2("# pstab: %u" % p.PSTAB)
+			elif 'setoption name maxnodes value' in l:
+				p.MAXNODES = int(l.split()[4])
+				print2("# maxnodes: %u" % p.MAXNODES)
+			elif 'setoption name matetest value' in l:
+				if l.split()[4] == "true":
+					p.MATETEST = True
+				else:
+					p.MATETEST = False
+				print2("# matetest: %s" % p.MATETEST)
+			elif 'setoption name pawnrule value' in l:
+				if l.split()[4] == "true":
+					p.PAWNRULE = True
+				else:
+					p.PAWNRULE = False
+				print2("# pawnrule: %s" % p.PAWNRULE)
+			elif 'setoption name usebook value' in l:
+				if l.split()[4] == "true":
+					p.USEBOOK = True
+				else:
+					p.USEBOOK = False
+				print2("# usebook: %s" % p.USEBOOK)
+			elif 'setoption name Hash value' in l:
+				p.HASH = int(l.split()[4])
+				print2("# Hash: %u" % p.HASH)
+			elif 'setoption name pmtlen value' in l:
+				p.PMTLEN = int(l.split()[4])
+				print2("# pmtlen: %u" % p.PMTLEN)
+			elif 'setoption name pmtstart value' in l:
+				p.PMTSTART = int(l.split()[4])
+				print2("# pmtstart: %u" % p.PMTSTART)
+
+			elif 'setoption name MoveError value' in l:
+				p.MoveError = int(l.split()[4])
+				print2("# MoveError: %u" % p.MoveError)
+			elif 'setoption name BlunderError value' in l:
+				p.BlunderError = int(l.split()[4])
+				print2("# BlunderError: %u" % p.BlunderError)
+			elif 'setoption name BlunderPercent value' in l:
+				p.BlunderPercent = int(l.split()[4])
+				print2("# BlunderPercent: %u" % p.BlunderPercent)
+			elif 'setoption name EasyLearn value' in l:
+				p.EasyLearn = int(l.split()[4])
+				print2("# EasyLearn: %u" % p.EasyLearn)
+			elif 'setoption name EasyLambda value' in l:
+				p.EasyLambda = int(l.split()[4]) / 10.
+				print2("# EasyLambda: %u" % p.EasyLambda)
+			elif 'setoption name PlayerAdvantage value' in l:
+				p.PlayerAdvantage = int(l.split()[4])
+				print2("# PlayerAdvantage: %u" % p.PlayerAdvantage)
+			elif 'setoption name Threads value' in l:
+				p.THREADS = int(l.split()[4])
+				print2("# Threads: %u" % p.THREADS)
+			elif 'setoption name Ponder value' in l:	# (the GUI decides when to ponder)
+				if l.split()[4] == "true":
+					p.PONDER = True
+				else:
+					p.PONDER = False
+				print2("# Ponder: %s" % p.PONDER)
+			elif 'setoption name StatsLog value' in l:
+				stats.LOG = l.split(' ', 4)[4].strip()
+				if stats.LOG == '<empty>':
+					stats.LOG = ''
+				print2("# StatsLog: %s" % stats.LOG)
+			elif 'setoption name UCI_Chess960 value' in l:
+				if l.split()[4] == "true":
+					p.Chess960 = True
+				else:
+					p.Chess960 = False
+				print2("# UCI_Chess960: %s" % p.Chess960)
+			elif l == 'isready':
+				if not d:
+					newgame()
+				print2("readyok")
+			elif 'setboard' in l:
+				fen = l.split(' ', 1)[1]
+				fromfen(fen)
+			elif l[:2] == 'go' or l == 'force':
+				if not d:
+					newgame()
+
+				if nm in ('Newt', 'PyTuroChamp'):	# engines with time management
+					set_time(l)
+
 				t, r = p.getmove(d, silent = True)
+				if 'ponder' in l.split():	# (the position after the expected reply, searched while the opponent thinks)
+					waitponder()
 				if r:
 					move(r)
+			elif l == '?':
+				print2("move", r)
+				if log:
+					log.write("move %s\n" % r)
+					log.flush()
+			else:
+				if not d:
+					newgame()
+				if l[0] in abc and l[2] in abc and l[1] in nn and l[3] in nn:
+					if len(l) == 6:
+						l = l[:4] + 'q'	# "Knights" outputs malformed UCI pawn promotion moves
+					d.push_uci(l)
+					pgn()
+					t, r = p.getmove(d, silent = True)
+					if r:
+						move(r)
 
 
@@ -4,10 +4,14 @@
 # http://en.chessbase.com/post/reconstructing-turing-s-paper-machine
 
 from pst import pst
+import material
+import draws
+import stats
+import sharedtt
 
 import chess as c
 import sys, math, time
-from random import random, expovariate, choice
+from random import random, expovariate, choice, Random
 
 # computer plays as Black by default
 
@@ -18,6 +22,9 @@ MAXPLIES = 1	# maximum search depth
 QPLIES    = MAXPLIES + 6
 PSTAB     = 0	# influence of piece-square table on moves, 0 = none
 MATETEST  = True	# if True, include mate and draw detection in the material eval
+BITPOS    = True	# if True, use the bitboard version of the positional evaluation (same scores, but faster)
+HASH      = 16	# transposition table size in MB, 0 = no table
+MAXNODES  = 0	# stop deepening the search when MAXNODES nodes are reached, 0 = no limit
 
 # Easy play / random play parameters
 MoveError = 0		# On every move, randomly select the best move or a move inferior by this value (in decipawns)
@@ -30,6 +37,36 @@ PlayerAdvantage = 0	# If not 0, keep the evaluation at least this many decipawns
 
 b = c.Board()
 NODES = 0
+STATS = stats.new()	# statistics of the current search
+
+# with time controls or a node limit, the search is deepened iteratively up to MAXPLIES
+wtime, btime, movestogo, movetime = -1, -1, -1, -1	# time management variables
+endtime = 0	# system time to finish move computation at, 0 = no time limit
+canstop = False	# may the current search be stopped? (not in the first iteration)
+searchok = True	# False if the current search was stopped
+STOP = None	# if set, a function that returns True if the search is to be stopped (checked every 256 nodes)
+REPLY = None	# best move at ply 0 of the last search tree, i.e. the expected reply to a root move (for pondering)
+
+# transposition table (https://chessprogramming.org/Transposition_Table)
+EXACT, LOWER, UPPER = 0, 1, 2	# entry types: exact score, lower bound, upper bound
+TTENTRY = 176	# approximate memory use of one table entry in bytes
+TT = []		# table entries: (key, plies left, full-width plies left, quiet, type, score, age)
+TTAGE = 0	# search number, older entries are replaced first
+SHARED = None	# transposition table in shared memory (see sharedtt.py), used instead of TT if set
+REVERSE = False	# if True, search the moves below the root in reverse order (for Lazy SMP helper processes)
+ZHASH = []	# Zobrist hashes of the pieces along the current search path
+MAT = []	# piece counts of the current search position
+QUIET = []	# was the move to each position along the search path quiet?
+MATES = {}	# cache for matemoves(): position key -> number of mating moves
+MATESIZE = 100000	# maximum number of cached positions
+
+def zobrist():
+	"Random numbers for Zobrist hashing (fixed seed, so all processes agree)"
+	r = Random(1950)
+	return [[r.getrandbits(64) for i in range(64)] for j in range(13)], r.getrandbits(64)
+
+# per piece and square; ZOBRIST[0] is for castling rights and en passant squares
+ZOBRIST, ZTURN = zobrist()
 
 ### Various test positions, with White to play:
 
@@ -55,8 +92,15 @@ def sqrt(x):
 
 def getpos(b):
 	"Get positional-play value for a board"
+	STATS['getpos'] += 1
+	if BITPOS:
+		return getpos2(b)
+	return getpos1(b)
+
+def getpos1(b):
+	"Get positional-play value for a board (square by square)"
 	ppv = 0
-	if not len(list(b.legal_moves)) and b.is_checkmate():
+	if b.is_checkmate():
 		if b.turn == c.WHITE:
 			ppv = -1000
 		else:
@@ -96,18 +140,13 @@ def getpos(b):
 					ppv += 1.5
 			# king safety
 			if m.piece_type == c.KING:
-				b2 = c.Board(b.fen())
-				b2.set_piece_at(i, c.Piece(c.QUEEN, COMPC))
-				mv_pt, cp_pt = 0, 0
-				a = b2.attacks(i)
-				for s in a:
-					e = b2.piece_at(s)
-					# empty square
-					if not e:
-						mv_pt += 1
-					# enemy square
-					elif e.color == PLAYC:
-						cp_pt += 2
+				# moves of a virtual queen on the King's square (sliding attacks from the occupancy)
+				occ = b.occupied
+				a = ( c.BB_RANK_ATTACKS[i][c.BB_RANK_MASKS[i] & occ]
+				    | c.BB_FILE_ATTACKS[i][c.BB_FILE_MASKS[i] & occ]
+				    | c.BB_DIAG_ATTACKS[i][c.BB_DIAG_MASKS[i] & occ] )
+				mv_pt = c.popcount(a & ~occ)			# empty squares
+				cp_pt = 2 * c.popcount(a & b.occupied_co[PLAYC])	# enemy squares
 				ppv -= sqrt(mv_pt + cp_pt)
 		if m and m.piece_type == c.PAWN and m.color == COMPC:
 			# pawn ranks advanced
@@ -125,11 +164,7 @@ def getpos(b):
 	# black king
 	if b.is_check():
 		ppv += .5
-	for y in b.legal_moves:
-		b.push(y)
-		if b.is_checkmate():
-			ppv += 1
-		b.pop()
+	ppv += matemoves(b)
 	# ppv has been computed as positive = good until here,
 	#   finally we add the sign here to be compatible with getval()'s score
 	if COMPC == c.WHITE:
@@ -137,128 +172,400 @@ def getpos(b):
 	else:
 		return -ppv
 
-def getval1(b):
+def getpos2(b):
+	"Get positional-play value for a board (with bitboards, same result as getpos1())"
+	ppv = 0
+	if b.is_checkmate():
+		if b.turn == c.WHITE:
+			ppv = -1000
+		else:
+			ppv =  1000
+	occ = b.occupied
+	enemy = b.occupied_co[PLAYC]
+	endgame = c.popcount(b.pawns) <= 8
+	# same order of squares (and thus of the floating-point additions) as in getpos1()
+	for i in c.scan_reversed(b.occupied_co[COMPC]):
+		mm = b.piece_type_at(i)
+		pp = mm
+		if pp == c.KING and endgame:	# endgame is different
+			pp = 8			#   for the King
+		if COMPC == c.WHITE:
+			ppv += PSTAB * pst[pp][i ^ 56] / 100
+		else:
+			ppv += PSTAB * pst[pp][i]      / 100
+
+		if mm == c.PAWN:
+			# pawn ranks advanced
+			if COMPC == c.WHITE:
+				ppv += .2 * (i // 8 - 1)
+			else:
+				ppv += .2 * (6 - i // 8)
+			# pawn defended (other pawns do not count)
+			if b.attackers_mask(COMPC, i) & ~b.pawns:
+				ppv += .3
+			continue
+
+		# mobility: empty squares count once, enemy squares twice
+		a = b.attacks_mask(i)
+		ppv += sqrt(c.popcount(a & ~occ) + 2 * c.popcount(a & enemy))
+		if mm != c.QUEEN and mm != c.KING:
+			ndef = c.popcount(b.attackers_mask(COMPC, i))
+			# defended
+			if ndef == 1:
+				ppv += 1
+			# twice defended
+			if ndef > 1:
+				ppv += 1.5
+		# king safety
+		if mm == c.KING:
+			# moves of a virtual queen on the King's square
+			a = ( c.BB_RANK_ATTACKS[i][c.BB_RANK_MASKS[i] & occ]
+			    | c.BB_FILE_ATTACKS[i][c.BB_FILE_MASKS[i] & occ]
+			    | c.BB_DIAG_ATTACKS[i][c.BB_DIAG_MASKS[i] & occ] )
+			ppv -= sqrt(c.popcount(a & ~occ) + 2 * c.popcount(a & enemy))
+	# black king
+	if b.is_check():
+		ppv += .5
+	ppv += matemoves(b)
+	if COMPC == c.WHITE:
+		return ppv
+	else:
+		return -ppv
+
+def givescheck(b, x, k, ortho, diag):
+	"Does legal move x give check? (k: enemy King, ortho/diag: our sliding pieces)"
+	if b.is_castling(x) or b.is_en_passant(x):
+		return b.gives_check(x)
+	f, t = x.from_square, x.to_square
+	p = x.promotion or b.piece_type_at(f)
+	occ = b.occupied & ~c.BB_SQUARES[f] | c.BB_SQUARES[t]
+	ra = c.BB_RANK_ATTACKS[k][c.BB_RANK_MASKS[k] & occ] | c.BB_FILE_ATTACKS[k][c.BB_FILE_MASKS[k] & occ]
+	da = c.BB_DIAG_ATTACKS[k][c.BB_DIAG_MASKS[k] & occ]
+	# discovered check
+	if ra & ortho & ~c.BB_SQUARES[f] or da & diag & ~c.BB_SQUARES[f]:
+		return True
+	# direct check by the moved piece
+	if p == c.PAWN:
+		return bool(c.BB_PAWN_ATTACKS[b.turn][t] & c.BB_SQUARES[k])
+	if p == c.KNIGHT:
+		return bool(c.BB_KNIGHT_ATTACKS[t] & c.BB_SQUARES[k])
+	if p in (c.ROOK, c.QUEEN) and ra & c.BB_SQUARES[t]:
+		return True
+	if p in (c.BISHOP, c.QUEEN) and da & c.BB_SQUARES[t]:
+		return True
+	return False
+
+def matemoves(b):
+	"Get number of moves that give checkmate (cached per position)"
+	global MATES
+
+	key = zkey(b, zhash(b))
+	if key in MATES:
+		return MATES[key]
+	n = 0
+	k = b.king(not b.turn)
+	if k is not None:
+		us = b.occupied_co[b.turn]
+		ortho = (b.rooks | b.queens) & us
+		diag = (b.bishops | b.queens) & us
+		for y in b.legal_moves:
+			# only checking moves can mate, and most checks can be answered with a King move
+			if givescheck(b, y, k, ortho, diag):
+				b.push(y)
+				if not any(b.generate_legal_moves(c.BB_SQUARES[k])) and not any(b.generate_legal_moves(c.BB_ALL & ~c.BB_SQUARES[k])):
+					n += 1
+				b.pop()
+	if len(MATES) >= MATESIZE:
+		MATES = {}
+	MATES[key] = n
+	return n
+
+def getval1(b, n = None):
 	"Get total piece value of board (White - Black, the usual method)"
+	if n is None:
+		n = material.count(b)
+	wn, bn = n[c.WHITE], n[c.BLACK]
 	return (
-		len(b.pieces(c.PAWN, c.WHITE))          - len(b.pieces(c.PAWN, c.BLACK))
-	+	3 * (len(b.pieces(c.KNIGHT, c.WHITE))   - len(b.pieces(c.KNIGHT, c.BLACK)))
-	+	3.5 * (len(b.pieces(c.BISHOP, c.WHITE)) - len(b.pieces(c.BISHOP, c.BLACK)))
-	+	5 * (len(b.pieces(c.ROOK, c.WHITE))     - len(b.pieces(c.ROOK, c.BLACK)))
-	+	10 * (len(b.pieces(c.QUEEN, c.WHITE))   - len(b.pieces(c.QUEEN, c.BLACK)))
+		wn[c.PAWN]          - bn[c.PAWN]
+	+	3 * (wn[c.KNIGHT]   - bn[c.KNIGHT])
+	+	3.5 * (wn[c.BISHOP] - bn[c.BISHOP])
+	+	5 * (wn[c.ROOK]     - bn[c.ROOK])
+	+	10 * (wn[c.QUEEN]   - bn[c.QUEEN])
 	)
 
-def getval2(b):
+def getval2(b, n = None):
 	"Get total piece value of board (White / Black, Turing's preferred method)"
+	if n is None:
+		n = material.count(b)
+	wn, bn = n[c.WHITE], n[c.BLACK]
 	wv = (
-		len(b.pieces(c.PAWN, c.WHITE))
-	+	3 * len(b.pieces(c.KNIGHT, c.WHITE))
-	+	3.5 * len(b.pieces(c.BISHOP, c.WHITE))
-	+	5 * len(b.pieces(c.ROOK, c.WHITE))
-	+	10 * len(b.pieces(c.QUEEN, c.WHITE))
+		wn[c.PAWN]
+	+	3 * wn[c.KNIGHT]
+	+	3.5 * wn[c.BISHOP]
+	+	5 * wn[c.ROOK]
+	+	10 * wn[c.QUEEN]
 	)
 	bv = (
-		len(b.pieces(c.PAWN, c.BLACK))
-	+	3 * len(b.pieces(c.KNIGHT, c.BLACK))
-	+	3.5 * len(b.pieces(c.BISHOP, c.BLACK))
-	+	5 * len(b.pieces(c.ROOK, c.BLACK))
-	+	10 * len(b.pieces(c.QUEEN, c.BLACK))
+		bn[c.PAWN]
+	+	3 * bn[c.KNIGHT]
+	+	3.5 * bn[c.BISHOP]
+	+	5 * bn[c.ROOK]
+	+	10 * bn[c.QUEEN]
 	)
 	return wv / bv
 
-def getval(b):
-	"Get total piece value of board"
+def getval(b, n = None):
+	"Get total piece value of board (n: piece counts, if they are already known)"
 
-	return getval1(b)
+	return getval1(b, n)
 
-def isdead(b, ml, p):
-	"Is the position dead? (quiescence)"
-	if p >= QPLIES or not len(ml):
-		return True
-	if b.is_check():
-		return False
+def isquiet(b):
+	"Was the last move quiet? (i.e. no capture that can be recaptured and no escape from check)"
 	x = b.pop()
-	if (b.is_capture(x) and len(b.attackers(not b.turn, x.to_square))) or b.is_check():
-		b.push(x)
+	q = isquietmove(b, x, b.is_check())
+	b.push(x)
+	return q
+
+def isquietmove(b, x, chk):
+	"Is move x quiet? (b is the board before the move, chk: is the side to move in check?)"
+	return not (chk or (b.is_capture(x) and b.attackers_mask(not b.turn, x.to_square)))
+
+def isdead(b, ml, p, quiet, chk):
+	"Is the position dead? (quiescence, ml: captures, chk: is the side to move in check?)"
+	if p >= QPLIES or not len(ml):	# (no captures is the same as no moves here)
+		return True
+	if chk:
 		return False
+	return quiet
+
+def zpiece(b, i):
+	"Zobrist number for the piece on a square"
+	m = b.piece_at(i)
+	if m:
+		return ZOBRIST[m.piece_type + 6 * m.color][i]
+	return 0
+
+def zhash(b):
+	"Zobrist hash of the pieces on the board"
+	h = 0
+	for i in b.piece_map().keys():
+		h ^= zpiece(b, i)
+	return h
+
+def zkey(b, h):
+	"Zobrist key of a position (h: Zobrist hash of its pieces)"
+	if b.turn == c.WHITE:
+		h ^= ZTURN
+	sp = b.castling_rights
+	if b.ep_square:
+		sp |= c.BB_SQUARES[b.ep_square]
+	for i in c.scan_forward(sp):
+		h ^= ZOBRIST[0][i]
+	return h
+
+def domove(b, x, chk):
+	"Make a move during the search and update the Zobrist hash, the piece counts and the quiet flags (chk: is the side to move in check?)"
+	QUIET.append(isquietmove(b, x, chk))
+	if b.is_castling(x):
+		sq = list(c.SquareSet(c.BB_RANKS[c.square_rank(x.from_square)]))
+	elif b.is_en_passant(x):
+		sq = [x.from_square, x.to_square, c.square(c.square_file(x.to_square), c.square_rank(x.from_square))]
 	else:
-		b.push(x)
-		return True
+		sq = [x.from_square, x.to_square]
+	h = ZHASH[-1]
+	for i in sq:
+		h ^= zpiece(b, i)
+	material.push(MAT, b, x)
+	for i in sq:
+		h ^= zpiece(b, i)
+	ZHASH.append(h)
+
+def undomove(b):
+	"Take back a move made with domove()"
+	ZHASH.pop()
+	QUIET.pop()
+	return material.pop(MAT, b)
+
+def setroot(b):
+	"Prepare the hash stack, the piece counts, the quiet flags and the transposition table for a new search tree"
+	global ZHASH, MAT, QUIET, TT
+
+	ZHASH = [zhash(b)]
+	QUIET = [isquiet(b)] if b.move_stack else [True]
+	MAT = material.count(b)
+	size = 0 if SHARED else HASH * 2**20 // TTENTRY
+	if len(TT) != size:
+		TT = size * [None]
+
+def ttprobe(key, ply, quiet, alpha, beta):
+	"Get a score from the transposition table, or None if there is no usable entry"
+	if SHARED:
+		e = sharedtt.read(SHARED, key)
+	else:
+		e = TT[key % len(TT)]
+	if not e or e[0] != key or e[1] != QPLIES - ply or e[2] != max(MAXPLIES - ply, 0) or e[3] != quiet:
+		return None
+	if e[4] == EXACT:
+		return e[5]
+	if e[4] == LOWER and e[5] >= beta:
+		return beta
+	if e[4] == UPPER and e[5] <= alpha:
+		return alpha
+	return None
+
+def ttstore(key, ply, quiet, flag, t):
+	"Store a score in the transposition table (depth-preferred replacement)"
+	age = TTAGE & 0xffff
+	if SHARED:
+		e = sharedtt.read(SHARED, key)
+		if not e or e[6] != age or QPLIES - ply >= e[1]:
+			sharedtt.write(SHARED, key, QPLIES - ply, max(MAXPLIES - ply, 0), quiet, flag, t, age)
+		return
+	i = key % len(TT)
+	e = TT[i]
+	if not e or e[6] != age or QPLIES - ply >= e[1]:
+		TT[i] = (key, QPLIES - ply, max(MAXPLIES - ply, 0), quiet, flag, t, age)
 
 # https://chessprogramming.org/Alpha-Beta
 def searchmax(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, searchok, REPLY
 
 	NODES += 1
-	if MATETEST and ply < 2 and b.is_check():
-		res = b.result(claim_draw = True)
+	if canstop and timeup():
+		searchok = False
+		return 0
+	if ply == 0:
+		setroot(b)
+		REPLY = None
+	if ply > MAXPLIES:	# (beyond the full-width depth)
+		STATS['qnodes'] += 1
+	chk = b.is_check()
+	if MATETEST and ply < 2 and chk:
+		res = draws.result(b, draws.start(b))
 		if res == '0-1':
 			return -1000
 		if res == '1-0':
 			return 1000
 		if res == '1/2-1/2':
 			return 0
-	ml = order(b, ply)
-	if ply >= MAXPLIES and isdead(b, ml, ply):
-		return getval(b)
+	quiet = ply >= MAXPLIES and QUIET[-1]
+	# draw claims make scores near the root depend on the game history
+	usett = (TT or SHARED) and not (MATETEST and ply < 2)
+	if usett:
+		key = zkey(b, ZHASH[-1])
+		t = ttprobe(key, ply, quiet, alpha, beta)
+		if t is not None:
+			return t
 	if ply >= MAXPLIES:
-		ml2 = []
-		for x in ml:
-			if b.is_capture(x):
-				ml2.append(x)
-		if len(ml2) == 0:	# no considerable moves
-			return getval(b)
+		# quiescence: only captures are searched, so only captures are generated
+		if ply > 0:
+			ml2 = list(b.generate_legal_captures())
+			if REVERSE:
+				ml2.reverse()
+		else:
+			ml2 = [x for x in order(b, ply) if b.is_capture(x)]
+		if isdead(b, ml2, ply, quiet, chk):
+			STATS['evals'] += 1
+			t = getval(b, MAT)
+			if usett:
+				ttstore(key, ply, quiet, EXACT, t)
+			return t
 	else:
-		ml2 = ml
-	for x in ml2:
-		b.push(x)
+		ml2 = order(b, ply)
+	a0 = alpha
+	for i, x in enumerate(ml2):
+		domove(b, x, chk)
 		t = searchmin(b, ply + 1, alpha, beta)
-		b.pop()
+		undomove(b)
+		if not searchok:	# out of time, the result is not used
+			return alpha
 		if t >= beta:
+			stats.cutoff(STATS, i)
+			if usett:
+				ttstore(key, ply, quiet, LOWER, beta)
 			return beta
 		if t > alpha:
 			alpha = t
+			if ply == 0:
+				REPLY = x
+	if usett:
+		ttstore(key, ply, quiet, EXACT if alpha > a0 else UPPER, alpha)
 	return alpha
 
 def searchmin(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, searchok, REPLY
 
 	NODES += 1
-	if MATETEST and ply < 2 and b.is_check():
-		res = b.result(claim_draw = True)
+	if canstop and timeup():
+		searchok = False
+		return 0
+	if ply == 0:
+		setroot(b)
+		REPLY = None
+	if ply > MAXPLIES:	# (beyond the full-width depth)
+		STATS['qnodes'] += 1
+	chk = b.is_check()
+	if MATETEST and ply < 2 and chk:
+		res = draws.result(b, draws.start(b))
 		if res == '0-1':
 			return -1000
 		if res == '1-0':
 			return 1000
 		if res == '1/2-1/2':
 			return 0
-	ml = order(b, ply)
-	if ply >= MAXPLIES and isdead(b, ml, ply):
-		return getval(b)
+	quiet = ply >= MAXPLIES and QUIET[-1]
+	# draw claims make scores near the root depend on the game history
+	usett = (TT or SHARED) and not (MATETEST and ply < 2)
+	if usett:
+		key = zkey(b, ZHASH[-1])
+		t = ttprobe(key, ply, quiet, alpha, beta)
+		if t is not None:
+			return t
 	if ply >= MAXPLIES:
-		ml2 = []
-		for x in ml:
-			if b.is_capture(x):
-				ml2.append(x)
-		if len(ml2) == 0:	# no considerable moves
-			return getval(b)
+		# quiescence: only captures are searched, so only captures are generated
+		if ply > 0:
+			ml2 = list(b.generate_legal_captures())
+			if REVERSE:
+				ml2.reverse()
+		else:
+			ml2 = [x for x in order(b, ply) if b.is_capture(x)]
+		if isdead(b, ml2, ply, quiet, chk):
+			STATS['evals'] += 1
+			t = getval(b, MAT)
+			if usett:
+				ttstore(key, ply, quiet, EXACT, t)
+			return t
 	else:
-		ml2 = ml
-	for x in ml2:
-		b.push(x)
+		ml2 = order(b, ply)
+	b0 = beta
+	for i, x in enumerate(ml2):
+		domove(b, x, chk)
 		t = searchmax(b, ply + 1, alpha, beta)
-		b.pop()
+		undomove(b)
+		if not searchok:	# out of time, the result is not used
+			return beta
 		if t <= alpha:
+			stats.cutoff(STATS, i)
+			if usett:
+				ttstore(key, ply, quiet, UPPER, alpha)
 			return alpha
 		if t < beta:
 			beta = t
+			if ply == 0:
+				REPLY = x
+	if usett:
+		ttstore(key, ply, quiet, EXACT if beta < b0 else LOWER, beta)
 	return beta
 
 def order(b, ply):
 	"Move ordering"
 	if ply > 0:
-		return list(b.legal_moves)
+		ml = list(b.legal_moves)
+		if REVERSE:
+			ml.reverse()
+		return ml
 	am, bm = [], []
 	for x in b.legal_moves:
 		if b.is_capture(x):
@@ -309,31 +616,38 @@ def getindex(ll):
 		else:
 			return 0
 
-def getmove(b, silent = False, usebook = False):
-	"Get move list for board"
-	global COMPC, PLAYC, MAXPLIES, NODES
-
-	lastpos = getpos(b)
-	ll = []
-	NODES = 0
-
-	if b.turn == c.WHITE:
-		COMPC = c.WHITE
-		PLAYC = c.BLACK
+def setendtime():
+	"Set system time to finish move computation at (0 = no time limit)"
+	global endtime
+
+	endtime = 0
+	if movetime > 0:
+		endtime = time.time() + movetime / 1000.
+		return
+	if wtime < 0 and btime < 0:
+		return
+	mtg = movestogo
+	if mtg < 0:
+		mtg = 60
+	if COMPC == c.WHITE:
+		thetime = wtime / 1000.
 	else:
-		COMPC = c.BLACK
-		PLAYC = c.WHITE
+		thetime = btime / 1000.
+	endtime = time.time() + thetime / (mtg + 3)
 
-	if not silent:
-		print(b.unicode())
-		print(getval(b))
-		print("FEN:", b.fen())
+def timeup():
+	"Has the time or node limit for this move been reached, or has the search been stopped?"
+	return ((endtime and time.time() > endtime) or (MAXNODES and NODES >= MAXNODES)
+		or (STOP and not NODES & 255 and STOP()))
 
+def getlist(b, lastpos, silent):
+	"Get sorted list of (move, positional value, score) for the root moves, or None if the search was stopped"
+	ll = []
 	nl = len(list(b.legal_moves))
 	cr0 = b.has_castling_rights(COMPC)
 
-	start = time.time()
 	for n, x in enumerate(b.legal_moves):
+		t0 = time.time()
 		if b.is_castling(x):		# are we castling now?
 			castle = pm()
 		else:
@@ -343,11 +657,11 @@ def getmove(b, silent = False, usebook = False):
 		cr = b.has_castling_rights(COMPC)
 		if cr0 == True and cr == True:	# can we still castle later?
 			p += pm()
-		for y in b.legal_moves:
-			if b.is_castling(y):	# can we castle in the next move?
-				p += pm()
+		for y in b.generate_castling_moves():	# can we castle in the next move?
+			p += pm()
+		t0 = stats.phase(STATS, 'pos', t0)
 
-		res = b.result(claim_draw = True)
+		res = draws.result(b, draws.start(b))
 		if res == '0-1':
 			t = -1000
 		elif res == '1-0':
@@ -359,6 +673,10 @@ def getmove(b, silent = False, usebook = False):
 				t = searchmin(b, 0, -1e6, 1e6)
 			else:
 				t = searchmax(b, 0, -1e6, 1e6)
+			if not searchok:
+				b.pop()
+				return None
+		stats.phase(STATS, 'search', t0)
 		if not silent:
 			print("(%u/%u) %s %.1f %.2f" % (n + 1, nl, x, p, t))
 		ll.append((x, p, t))
@@ -367,10 +685,120 @@ def getmove(b, silent = False, usebook = False):
 	ll.sort(key = lambda m: m[1] + 1000 * m[2])
 	if COMPC == c.WHITE:
 		ll.reverse()
+	return ll
+
+def expected(b, x, t, y = None):
+	"Get the reply to root move x with score t that the opponent is expected to play (y: a reply that is known to reach t), None if stopped"
+	# of the replies that reach t, the one with the best positional value for the opponent
+	#   (the search itself keeps the first one, and most replies reach the same material score)
+	global COMPC, PLAYC
+
+	compc = COMPC
+	b.push(x)
+	# rank the replies as getlist() would for the opponent
+	COMPC, PLAYC = PLAYC, COMPC
+	lastpos = getpos(b)
+	cr0 = b.has_castling_rights(COMPC)
+	ll = []
+	for z in b.legal_moves:
+		if b.is_castling(z):
+			castle = pm()
+		else:
+			castle = 0
+		b.push(z)
+		p = getpos(b) - lastpos + castle
+		cr = b.has_castling_rights(COMPC)
+		if cr0 == True and cr == True:
+			p += pm()
+		for w in b.generate_castling_moves():
+			p += pm()
+		b.pop()
+		ll.append((z, p))
+	ll.sort(key = lambda m: m[1])
+	if COMPC == c.WHITE:
+		ll.reverse()
+	COMPC, PLAYC = PLAYC, COMPC
+
+	# the first of them that reaches t, tested with a null-window search as in the tree of x
+	r = None
+	setroot(b)
+	chk = b.is_check()
+	for z, p in ll:
+		if z == y:
+			r = z
+			break
+		domove(b, z, chk)
+		if compc == c.WHITE:	# (the opponent minimizes)
+			ok = searchmax(b, 1, t, t + .001) <= t
+		else:
+			ok = searchmin(b, 1, t - .001, t) >= t
+		undomove(b)
+		if not searchok:
+			break
+		if ok:
+			r = z
+			break
+	b.pop()
+	return r
+
+def getmove(b, silent = False, usebook = False):
+	"Get move list for board"
+	global COMPC, PLAYC, MAXPLIES, QPLIES, NODES, TTAGE, STATS, searchok, canstop
+
+	STATS = stats.new()
+	t0 = time.time()
+	lastpos = getpos(b)
+	stats.phase(STATS, 'pos', t0)
+	NODES = 0
+	TTAGE += 1
+
+	if b.turn == c.WHITE:
+		COMPC = c.WHITE
+		PLAYC = c.BLACK
+	else:
+		COMPC = c.BLACK
+		PLAYC = c.WHITE
+
+	if not silent:
+		print(b.unicode())
+		print(getval(b))
+		print("FEN:", b.fen())
+
+	start = time.time()
+	setendtime()	# set end time for computation based on time control
+	maxplies, qplies = MAXPLIES, QPLIES
+	if endtime or MAXNODES:	# iterative deepening up to MAXPLIES
+		depths = range(min(1, maxplies), maxplies + 1)
+	else:
+		depths = [maxplies]
+	ll = None
+	shown = -1	# depth of the last iteration whose info line has been printed
+	try:
+		for MAXPLIES in depths:
+			QPLIES = qplies - maxplies + MAXPLIES
+			# the first iteration is always finished, so there is a move to play
+			canstop, searchok = ll is not None, True
+			l2 = getlist(b, lastpos, silent)
+			if l2 is None:
+				break
+			ll, depth = l2, MAXPLIES
+			if MAXPLIES < maxplies:
+				if timeup():
+					break	# (the info line of this iteration is printed below)
+				print('info depth %d seldepth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1, QPLIES + 1,
+					100 * pm() * ll[0][2], 1000 * (time.time() - start), NODES, str(ll[0][0])))
+				sys.stdout.flush()
+				shown = depth
+	finally:
+		MAXPLIES, QPLIES = maxplies, qplies
+		canstop, searchok = False, True
+
 	i = getindex(ll)
 	#print('# %.2f %s' % (ll[i][1] + ll[i][2], [str(ll[i][0])]))
-	print('info depth %d seldepth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1, QPLIES + 1,
-		100 * pm() * ll[i][2], 1000 * (time.time() - start), NODES, str(ll[i][0])))
+	if depth != shown or i:	# (not again if the next iteration was stopped)
+		print('info depth %d seldepth %d score cp %d time %d nodes %d pv %s' % (depth + 1, qplies - maxplies + depth + 1,
+			100 * pm() * ll[i][2], 1000 * (time.time() - start), NODES, str(ll[i][0])))
+	stats.info(STATS, NODES, depth + 1, 'PyTuroChamp')
 	return ll[i][1] + ll[i][2], [str(ll[i][0])]
 
 if __name__ == '__main__':
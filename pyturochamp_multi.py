@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 # Multiprocessing version of PyTuroChamp
-# (needs the fork multiprocessing start method, so it is mainly for Linux)
+# (the worker processes of ptc_worker.py are started by the first search)
 
 # A Python chess engine,
 # inspired by (but not compatible with)
@@ -9,8 +9,9 @@
 
 import ptc_worker
 import pyturochamp as ptc
+import sharedtt, stats
 import chess as c
-import sys, math, time
+import sys, math, time, atexit
 from queue import Empty, Full
 from random import random, choice
 
@@ -24,6 +25,13 @@ QPLIES    = MAXPLIES + 2
 PSTAB     = 0	# influence of piece-square table on moves, 0 = none
 PDEAD     = 1   # version of dead position eval
 MATETEST  = False	# if True, include mate and draw detection in the material eval
+HASH      = 16	# transposition table size in MB per worker, 0 = no table
+WAIT      = 1	# seconds between PROGRESS calls while no worker result comes in
+TIMEOUT   = 600	# seconds without a worker result before the remaining moves are searched here, 0 = wait forever
+PROGRESS  = None	# if set, called as PROGRESS(results, root moves, result or None) while waiting
+THREADS   = 0	# number of worker processes, 0 = one per CPU
+SMP       = False	# if True, every worker searches all root moves with one shared table of HASH MB (Lazy SMP)
+PONDER    = False	# if True, getmove() also gets the reply that it expects, for the GUI to ponder on (UCI option Ponder)
 
 # Easy play / random play parameters
 MoveError = 0		# On every move, randomly select the best move or a move inferior by this value (in decipawns)
@@ -32,8 +40,12 @@ BlunderError = 0	# If blundering this move, randomly select the best move or a m
 BlunderPercent = 0	# Percent chance of blundering this move
 
 b = c.Board()
-
-ptc_worker.start()
+TABLE = None	# shared transposition table for SMP
+TABLEMB = 0	# its size in MB
+COST = [{}, {}]	# nodes that each root move (UCI) took in the last search for Black/White, for sending the expensive ones first
+PONDERMOVE = None	# expected reply to the move of the last getmove() (UCI), None if not known or PONDER is off
+STATS = stats.new()	# statistics of the last search, added up over the worker processes
+STOPPED = False	# set by stop(), cleared by go(): a stop that comes before getmove() has started its job is not lost
 
 def pm():
 	if COMPC == c.WHITE:
@@ -55,12 +67,74 @@ def getindex(ll):
 		mm = [x for x in inds if (abs(x[0] - vals[0]) < err)]
 		return choice(mm)[1]
 
+def removetable():
+	"Free the shared transposition table"
+	global TABLE
+
+	if TABLE:
+		sharedtt.remove(TABLE)
+		TABLE = None
+
+atexit.register(removetable)
+
+def submit(job, b, board, inlist, lastpos, cr0):
+	"Put the tasks of a search into the query queue"
+	global TABLE, TABLEMB
+
+	if not SMP:	# one task per root move, the most expensive ones first
+		for x in ptc_worker.bycost(b, inlist, COST[COMPC]):
+			ptc_worker.submit(job, ptc_worker.task, *board + (x.uci(), lastpos, COMPC, cr0,
+				MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH), key = ptc_worker.movekey(x))
+		return
+	mb = max(HASH, 1)
+	if TABLE and TABLEMB != mb:	# table size changed
+		removetable()
+	if not TABLE:
+		TABLE, TABLEMB = sharedtt.create(mb), mb
+	n = ptc_worker.num_w
+	for k in range(n):	# one task per worker, each one starting on a different root move
+		ptc_worker.submit(job, ptc_worker.smptask, *board + (k, n, lastpos, COMPC, cr0,
+			MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH, TABLE.name), key = k)
+
+def expected(board, x, t, y):
+	"Get the reply to root move x with score t that the opponent is expected to play (UCI), None if stopped"
+	# (asks the worker that searched x, which still has its positions in the transposition table;
+	#   y: the reply that the search of x found, see ptc.expected())
+	job = ptc_worker.newjob()
+	ptc_worker.submit(job, ptc_worker.replytask, *board + (x.uci(), t, y.uci() if y else '', COMPC,
+		MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH), key = ptc_worker.movekey(x))
+	if STOPPED:	# (stopped before the job was started)
+		ptc_worker.cancel()
+	last = time.time()
+	while True:
+		try:
+			r = ptc_worker.get(job, WAIT)
+		except Empty:
+			if TIMEOUT and time.time() - last > TIMEOUT:
+				ptc_worker.cancel()
+				return None
+			continue
+		return r[0] if r else None
+
+def go():
+	"Prepare for a new search: call this when the go command is read, before the stop for it can come"
+	global STOPPED
+	STOPPED = False
+
+def stop():
+	"Stop the current search (getmove() then returns the best move among those searched so far)"
+	global STOPPED
+	STOPPED = True	# (also if getmove() has not started its job yet)
+	ptc_worker.cancel()
+
 def getmove(b, silent = False, usebook = False):
 	"Get move list for board"
-	global COMPC, PLAYC, MAXPLIES
+	global COMPC, PLAYC, MAXPLIES, PONDERMOVE, STATS
 
 	lastpos = ptc.getpos(b)
 	ll = []
+	more = []	# SMP: results for moves that another worker had already finished
+	ok = True	# False if the search was stopped or the workers did not answer
 
 	if b.turn == c.WHITE:
 		COMPC = c.WHITE
@@ -81,23 +155,64 @@ def getmove(b, silent = False, usebook = False):
 	nummov = len(inlist)
 
 	start = time.time()
+	ptc_worker.start(THREADS)
+	job = ptc_worker.newjob()	# (also stops what is left of an earlier search)
+	board = ptc_worker.encode(b, MATETEST)	# the game history is only needed for draw claims
+	submit(job, b, board, inlist, lastpos, cr0)	# submit all tasks at once, then wait for the results
+	if STOPPED:	# (stopped before the job was started)
+		ptc_worker.cancel()
+	last = time.time()
 	while len(ll) < nummov:
-		#if len(inlist) > 0:
-		#	print(len(inlist), len(ll), nummov)
-		if len(inlist):
-			ptc_worker.urlq.put_nowait(
-				(b.copy(), inlist.pop(), lastpos, COMPC, cr0, MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST))
 		try:
-			ll.append(ptc_worker.urlr.get_nowait())
+			r = ptc_worker.get(job, WAIT)
 		except Empty:
-			pass
+			if PROGRESS:
+				PROGRESS(len(ll), nummov, None)
+			if TIMEOUT and time.time() - last > TIMEOUT:
+				# workers are stuck or gone: search the remaining moves here
+				ptc_worker.cancel()
+				done = [m[0] for m in ll]
+				for x in inlist:
+					if x not in done:
+						ll.append(ptc_worker.task(*board + (x.uci(), lastpos, COMPC, cr0,
+							MAXPLIES, QPLIES, PSTAB, PDEAD, MATETEST, HASH)))
+				ok = False
+				break
+			continue
+		if r is None:	# stopped
+			ok = False
+			break
+		last = time.time()
+		if SMP:
+			if r[0] in [m[0] for m in ll]:
+				more.append(r)
+				continue
+		ll.append(r)
+		if not silent:
+			print("(%u/%u) %s %.1f %.2f" % (len(ll), nummov, r[0], r[1], r[2]))
+		if PROGRESS:
+			PROGRESS(len(ll), nummov, r)
+	if SMP:
+		ptc_worker.cancel()	# the helpers are not needed any more
+	if not ll:	# stopped before any move was searched
+		ll = [(inlist[0], 0, 0, 0, stats.new(), None)]
+	ll.sort(key = lambda m: inlist.index(m[0]))	# equal moves in the same order as with one process
 	ll.sort(key = lambda m: m[1] + 1000 * m[2])
 	if COMPC == c.WHITE:
 		ll.reverse()
+	# add up the statistics of the worker processes (phase times are CPU time over all workers)
+	nodes, STATS = 0, stats.new()
+	for m in ll + more:
+		nodes += m[3]
+		stats.add(STATS, m[4])
+	if not SMP:
+		COST[COMPC] = dict((m[0].uci(), m[3]) for m in ll)
 	i = getindex(ll)
+	PONDERMOVE = expected(board, ll[i][0], ll[i][2], ll[i][5]) if ok and PONDER else None
 	#print('# %.2f %s' % (ll[i][1] + ll[i][2], [str(ll[i][0])]))
-	print('info depth %d seldepth %d score cp %d time %d pv %s' % (MAXPLIES + 1, QPLIES + 1,
-		100 * pm() * ll[i][2], 1000 * (time.time() - start), str(ll[i][0])))
+	print('info depth %d seldepth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1, QPLIES + 1,
+		100 * pm() * ll[i][2], 1000 * (time.time() - start), nodes, str(ll[i][0])))
+	stats.info(STATS, nodes, MAXPLIES + 1, 'PyTuroChamp Multi-Core')
 	return ll[i][1] + ll[i][2], [str(ll[i][0])]
 
 if __name__ == '__main__':
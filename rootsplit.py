@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Parallel search of the root moves for the engines:
+#   the root moves are split among the worker processes of ptc_worker.py.
+#   An engine module plugs in with
+#     THREADS                  the number of processes to use, 1 = search the moves in this process,
+#     PARAMS                   the names of the module globals that its search depends on, and
+#     searchroot(b, x, ...)    which searches root move x on board b and returns a tuple of results,
+#   and calls search() in its getmove() instead of looping over the root moves itself.
+#   ptc_worker.py (and with it pyturochamp.py and the shared memory of Python 3.8) is only imported
+#   when more than one process is used, so the engines start as fast as before with THREADS = 1.
+
+import stats
+import importlib, os, time
+from queue import Empty
+
+WAIT    = 1	# seconds between checks while no worker result comes in
+TIMEOUT = 600	# seconds without a worker result before the remaining moves are searched here, 0 = wait forever
+
+COST = {}	# nodes that each root move (UCI) took in the last search of each engine and side, for sending the expensive ones first
+
+def modname(e):
+	"Get the name for importing engine module e in a worker process (also if it runs as a script)"
+	if e.__name__ == '__main__':
+		return os.path.splitext(os.path.basename(e.__file__))[0]
+	return e.__name__
+
+def task(name, params, board, i, x, args):
+	"Search root move number i (x in UCI notation) with the given module globals of engine name"
+	import ptc_worker
+	e = importlib.import_module(name)
+	for k, v in params.items():
+		setattr(e, k, v)
+	e.NODES = 0
+	e.STATS = stats.new()
+	b = ptc_worker.decode(*board)
+	r = e.searchroot(b, b.parse_uci(x), *args)
+	return i, r, e.NODES, e.STATS
+
+def search(e, b, moves, *args):
+	"Search root moves on board b with engine module e, yield the results of e.searchroot() in the order of moves"
+	if e.THREADS <= 1 or len(moves) < 2:
+		for x in moves:
+			yield e.searchroot(b, x, *args)
+		return
+
+	import ptc_worker
+	ptc_worker.start(e.THREADS)
+	job = ptc_worker.newjob()	# (also stops what is left of an earlier search)
+	name = modname(e)
+	params = dict((k, getattr(e, k)) for k in e.PARAMS)
+	board = ptc_worker.encode(b)
+	for x in ptc_worker.bycost(b, moves, COST.get((name, b.turn), {})):
+		ptc_worker.submit(job, task, name, params, board, moves.index(x), x.uci(), args, key = ptc_worker.movekey(x))
+	cost = COST[name, b.turn] = {}
+
+	res = len(moves) * [None]
+	n = 0	# results passed on so far
+	last = time.time()
+	while n < len(moves):
+		try:
+			r = ptc_worker.get(job, WAIT)
+		except Empty:
+			if TIMEOUT and time.time() - last > TIMEOUT:
+				# workers are stuck or gone: search the remaining moves here
+				ptc_worker.cancel()
+				for i in range(n, len(moves)):
+					yield res[i] if res[i] else e.searchroot(b, moves[i], *args)
+				return
+			continue
+		if r is None:	# stopped
+			return
+		last = time.time()
+		res[r[0]] = r[1]
+		cost[moves[r[0]].uci()] = r[2]
+		e.NODES += r[2]
+		stats.add(e.STATS, r[3])
+		while n < len(moves) and res[n]:
+			yield res[n]
+			n += 1
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 import chess as c
+import material
+import draws
+import stats
+import rootsplit
 import sys, math, time
 
 # computer plays as Black by default
@@ -12,9 +16,15 @@ MAXPLIES = 1	# maximum search depth
 QPLIES    = MAXPLIES + 6
 MATETEST  = True	# if True, include draw and mate on next move detection in the material eval
 PAWNRULE  = True	# use pawn criteria
+THREADS   = 1	# number of processes searching the root moves (see rootsplit.py)
+PARAMS    = 'COMPC', 'PLAYC', 'MAXPLIES', 'QPLIES', 'MATETEST', 'PAWNRULE'	# globals needed by searchroot()
 
 b = c.Board()
 NODES = 0
+STATS = stats.new()	# statistics of the current search
+MAT = []	# piece counts of the current search position
+QUIET = []	# was the move to each position along the search path quiet?
+REP = []	# keys of the positions since the last irreversible move along the search path (see draws.py)
 
 def getpawnfile(b, col):
 	pf = 10 * [0]
@@ -81,14 +91,17 @@ def getback(b, col):
 						back += 1
 	return back
 
-def getval(b):
-	"Get total piece value of board"
+def getval(b, n = None):
+	"Get total piece value of board (n: piece counts, if they are already known)"
+	if n is None:
+		n = material.count(b)
+	wn, bn = n[c.WHITE], n[c.BLACK]
 	v = (
-		len(b.pieces(c.PAWN, c.WHITE))          - len(b.pieces(c.PAWN, c.BLACK))
-	+	3 * (len(b.pieces(c.KNIGHT, c.WHITE))   - len(b.pieces(c.KNIGHT, c.BLACK)))
-	+	3 * (len(b.pieces(c.BISHOP, c.WHITE))   - len(b.pieces(c.BISHOP, c.BLACK)))
-	+	5 * (len(b.pieces(c.ROOK, c.WHITE))     - len(b.pieces(c.ROOK, c.BLACK)))
-	+	9 * (len(b.pieces(c.QUEEN, c.WHITE))    - len(b.pieces(c.QUEEN, c.BLACK)))
+		wn[c.PAWN]        - bn[c.PAWN]
+	+	3 * (wn[c.KNIGHT] - bn[c.KNIGHT])
+	+	3 * (wn[c.BISHOP] - bn[c.BISHOP])
+	+	5 * (wn[c.ROOK]   - bn[c.ROOK])
+	+	9 * (wn[c.QUEEN]  - bn[c.QUEEN])
 	)
 	if PAWNRULE:
 		wf = getpawnfile(b, c.WHITE)
@@ -109,49 +122,72 @@ def getval(b):
 	v += .1 * (wmov - bmov)
 	return v
 
-def isdead(b, ml, p):
-	"Is the position dead? (quiescence)"
-	if p >= QPLIES or not len(ml):
-		return True
+def isquiet(b):
+	"Was the last move quiet? (i.e. no capture that can be recaptured)"
 	x = b.pop()
-	if (b.is_capture(x) and len(b.attackers(not b.turn, x.to_square))):
-		b.push(x)
-		return False
-	else:
-		b.push(x)
+	q = isquietmove(b, x)
+	b.push(x)
+	return q
+
+def isquietmove(b, x):
+	"Is move x quiet? (b is the board before the move)"
+	return not (b.is_capture(x) and b.attackers_mask(not b.turn, x.to_square))
+
+def isdead(b, ml, p, quiet):
+	"Is the position dead? (quiescence, ml: captures)"
+	if p >= QPLIES or not len(ml):	# (no captures is the same as no moves here)
 		return True
+	return quiet
+
+def domove(b, x):
+	"Make a move during the search and update the piece counts, the quiet flags and the position keys"
+	QUIET.append(isquietmove(b, x))
+	material.push(MAT, b, x)
+	draws.push(REP, b)
+
+def undomove(b):
+	"Take back a move made with domove()"
+	QUIET.pop()
+	draws.pop(REP)
+	return material.pop(MAT, b)
 
 # https://chessprogramming.org/Alpha-Beta
 def searchmax(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, MAT, QUIET, REP
 
 	NODES += 1
+	if ply == 0:	# new search tree
+		MAT = material.count(b)
+		QUIET = [isquiet(b)] if b.move_stack else [True]
+		REP = draws.start(b)
+	if ply > MAXPLIES:	# (beyond the full-width depth)
+		STATS['qnodes'] += 1
 	if MATETEST:
-		res = b.result(claim_draw = True)
+		res = draws.result(b, REP)
 		if res == '0-1':
 			return -1000
 		if res == '1-0':
 			return 1000
 		if res == '1/2-1/2':
 			return 0
-	ml = order(b, ply)
-	if ply >= MAXPLIES and isdead(b, ml, ply):
-		return getval(b)
 	if ply >= MAXPLIES:
-		ml2 = []
-		for x in ml:
-			if b.is_capture(x):
-				ml2.append(x)
-		if len(ml2) == 0:	# no considerable moves
-			return getval(b)
+		# quiescence: only captures are searched, so only captures are generated
+		if ply > 0:
+			ml2 = list(b.generate_legal_captures())
+		else:
+			ml2 = [x for x in order(b, ply) if b.is_capture(x)]
+		if isdead(b, ml2, ply, QUIET[-1]):
+			STATS['evals'] += 1
+			return getval(b, MAT)
 	else:
-		ml2 = ml
-	for x in ml2:
-		b.push(x)
+		ml2 = order(b, ply)
+	for i, x in enumerate(ml2):
+		domove(b, x)
 		t = searchmin(b, ply + 1, alpha, beta)
-		b.pop()
+		undomove(b)
 		if t >= beta:
+			stats.cutoff(STATS, i)
 			return beta
 		if t > alpha:
 			alpha = t
@@ -159,34 +195,40 @@ def searchmax(b, ply, alpha, beta):
 
 def searchmin(b, ply, alpha, beta):
 	"Search moves and evaluate positions"
-	global NODES
+	global NODES, MAT, QUIET, REP
 
 	NODES += 1
+	if ply == 0:	# new search tree
+		MAT = material.count(b)
+		QUIET = [isquiet(b)] if b.move_stack else [True]
+		REP = draws.start(b)
+	if ply > MAXPLIES:	# (beyond the full-width depth)
+		STATS['qnodes'] += 1
 	if MATETEST:
-		res = b.result(claim_draw = True)
+		res = draws.result(b, REP)
 		if res == '0-1':
 			return -1000
 		if res == '1-0':
 			return 1000
 		if res == '1/2-1/2':
 			return 0
-	ml = order(b, ply)
-	if ply >= MAXPLIES and isdead(b, ml, ply):
-		return getval(b)
 	if ply >= MAXPLIES:
-		ml2 = []
-		for x in ml:
-			if b.is_capture(x):
-				ml2.append(x)
-		if len(ml2) == 0:	# no considerable moves
-			return getval(b)
+		# quiescence: only captures are searched, so only captures are generated
+		if ply > 0:
+			ml2 = list(b.generate_legal_captures())
+		else:
+			ml2 = [x for x in order(b, ply) if b.is_capture(x)]
+		if isdead(b, ml2, ply, QUIET[-1]):
+			STATS['evals'] += 1
+			return getval(b, MAT)
 	else:
-		ml2 = ml
-	for x in ml2:
-		b.push(x)
+		ml2 = order(b, ply)
+	for i, x in enumerate(ml2):
+		domove(b, x)
 		t = searchmax(b, ply + 1, alpha, beta)
-		b.pop()
+		undomove(b)
 		if t <= alpha:
+			stats.cutoff(STATS, i)
 			return alpha
 		if t < beta:
 			beta = t
@@ -218,12 +260,34 @@ def pm():
 	else:
 		return -1
 
+def searchroot(b, x):
+	"Search root move x, return (move, positional value, score)"
+	t0 = time.time()
+	b.push(x)
+	p = 0
+	if COMPC == c.WHITE:
+		t = searchmin(b, 0, -1e6, 1e6)
+	else:
+		t = searchmax(b, 0, -1e6, 1e6)
+	if MATETEST:
+		res = draws.result(b, REP)	# (the search has taken back its moves)
+		if res == '1/2-1/2':
+			t = 0
+		if res == '1-0':
+			t = 1e8
+		if res == '0-1':
+			t = -1e8
+	stats.phase(STATS, 'search', t0)
+	b.pop()
+	return x, p, t
+
 def getmove(b, silent = False, usebook = False):
 	"Get move list for board"
-	global COMPC, PLAYC, MAXPLIES, NODES
+	global COMPC, PLAYC, MAXPLIES, NODES, STATS
 
 	ll = []
 	NODES = 0
+	STATS = stats.new()
 
 	if b.turn == c.WHITE:
 		COMPC = c.WHITE
@@ -240,25 +304,10 @@ def getmove(b, silent = False, usebook = False):
 	nl = len(list(b.legal_moves))
 
 	start = time.time()
-	for n, x in enumerate(b.legal_moves):
-		b.push(x)
-		p = 0
-		if COMPC == c.WHITE:
-			t = searchmin(b, 0, -1e6, 1e6)
-		else:
-			t = searchmax(b, 0, -1e6, 1e6)
-		if MATETEST:
-			res = b.result(claim_draw = True)
-			if res == '1/2-1/2':
-				t = 0
-			if res == '1-0':
-				t = 1e8
-			if res == '0-1':
-				t = -1e8
+	for n, (x, p, t) in enumerate(rootsplit.search(sys.modules[__name__], b, list(b.legal_moves))):
 		if not silent:
 			print("(%u/%u) %s %.1f %.2f" % (n + 1, nl, x, p, t))
 		ll.append((x, p, t))
-		b.pop()
 
 	ll.sort(key = lambda m: m[1] + 1000 * m[2])
 	if COMPC == c.WHITE:
@@ -266,6 +315,7 @@ def getmove(b, silent = False, usebook = False):
 	print('# %.2f %s' % (ll[0][1] + ll[0][2], [str(ll[0][0])]))
 	print('info depth %d score cp %d time %d nodes %d pv %s' % (MAXPLIES + 1,
 		100 * pm () * ll[0][2], 1000 * (time.time() - start), NODES, str(ll[0][0])))
+	stats.info(STATS, NODES, MAXPLIES + 1, 'Shannon')
 	return ll[0][1] + ll[0][2], [str(ll[0][0])]
 
 if __name__ == '__main__':
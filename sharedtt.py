@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# Transposition table in shared memory for several worker processes
+#   (https://chessprogramming.org/Shared_Hash_Table):
+#   entries are read and written without locks, so each one is stored as the
+#   three words (key ^ data ^ score, data, score) and only used if the XOR of
+#   the three words gives back a key that belongs in its slot, i.e. if it was not
+#   torn by two processes writing at the same time (lockless hashing by Hyatt and Mann).
+
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+ENTRY = 24	# bytes per entry
+WORDS = struct.Struct('<QQQ')
+SCORE = struct.Struct('<d')
+BITS  = struct.Struct('<Q')
+
+def create(mb):
+	"Create a shared table of about mb MB"
+	n = max(mb * 2**20 // ENTRY, 1)
+	return shared_memory.SharedMemory(create = True, size = n * ENTRY)	# (filled with zeros)
+
+def attach(name):
+	"Open the shared table with the given name in another process"
+	shm = shared_memory.SharedMemory(name = name)
+	# the creating process removes the table, not this one
+	resource_tracker.unregister(shm._name, 'shared_memory')
+	return shm
+
+def remove(shm):
+	"Free a shared table made with create()"
+	# (workers that share the resource tracker with this process, e.g. with the spawn
+	#   start method, have already unregistered the table in attach())
+	resource_tracker.register(shm._name, 'shared_memory')
+	shm.close()
+	shm.unlink()
+
+def read(shm, key):
+	"Get the entry (key, plies left, full-width plies left, quiet, type, score, age) in the slot for key, or None"
+	buf = shm.buf
+	n = len(buf) // ENTRY
+	i = key % n * ENTRY
+	raw = bytes(buf[i:i + ENTRY])	# one snapshot, which is then checked
+	w0, w1, w2 = WORDS.unpack(raw)
+	k = w0 ^ w1 ^ w2
+	if not w1 or k % n * ENTRY != i:
+		return None
+	return (k, (w1 >> 1 & 255) - 128, w1 >> 9 & 255, bool(w1 >> 17 & 1), w1 >> 18 & 3,
+		SCORE.unpack_from(raw, 16)[0], w1 >> 20)
+
+def write(shm, key, plies, fwplies, quiet, flag, score, age):
+	"Store an entry for key (plies: -128...127, fwplies: 0...255)"
+	buf = shm.buf
+	i = key % (len(buf) // ENTRY) * ENTRY
+	w1 = 1 | (plies + 128 & 255) << 1 | (fwplies & 255) << 9 | bool(quiet) << 17 | flag << 18 | (age & 0xffff) << 20
+	w2 = BITS.unpack(SCORE.pack(score))[0]
+	buf[i:i + ENTRY] = WORDS.pack(key ^ w1 ^ w2, w1, w2)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Search statistics for the engines:
+#   every engine counts what its search does in a dict from new(),
+#   which is printed after each move as UCI "info string" lines
+#   and, if LOG is set, also appended to a file as one JSON line.
+
+import json, sys, time
+
+LOG = ''	# if not empty, append the statistics of each move as a JSON line to this file
+
+def new():
+	"Get zeroed counters for a new search"
+	return {'qnodes': 0, 'evals': 0, 'getpos': 0, 'cutoffs': 0, 'firstcutoffs': 0, 'time': {}}
+
+def phase(s, name, t0):
+	"Add the time since t0 to phase name and return the current time"
+	t = time.time()
+	s['time'][name] = s['time'].get(name, 0) + t - t0
+	return t
+
+def cutoff(s, i):
+	"Count a beta cutoff on the i-th move searched (counting from 0)"
+	s['cutoffs'] += 1
+	if i == 0:
+		s['firstcutoffs'] += 1
+
+def add(s, s2):
+	"Add the counters of s2 (e.g. from a worker process) to s"
+	for k, v in s2.items():
+		if k == 'time':
+			for p, t in v.items():
+				s['time'][p] = s['time'].get(p, 0) + t
+		else:
+			s[k] += v
+
+def summary(s, nodes, depth):
+	"Get the statistics of a search with nodes nodes and depth full-width plies as a flat dict"
+	d = {'nodes': nodes - s['qnodes']}	# full-width nodes (up to and including the full-width depth)
+	for k, v in s.items():
+		if k != 'time':
+			d[k] = v
+	# share of the beta cutoffs that happened on the first move searched
+	d['firstcutoffrate'] = s['firstcutoffs'] / s['cutoffs'] if s['cutoffs'] else 0
+	# effective branching factor: b with b ** depth = full-width nodes (+ 1 for the root)
+	d['ebf'] = (d['nodes'] + 1) ** (1. / depth) if depth > 0 else 0
+	for p, t in s['time'].items():
+		d['time_' + p] = round(t, 4)
+	return d
+
+def info(s, nodes, depth, engine = ''):
+	"Print the statistics of a search as UCI info strings (and log them as JSON if LOG is set)"
+	d = summary(s, nodes, depth)
+	print('info string nodes %d qnodes %d evals %d getpos %d cutoffs %d firstcutoffrate %.2f ebf %.2f' % (
+		d['nodes'], d['qnodes'], d['evals'], d['getpos'], d['cutoffs'], d['firstcutoffrate'], d['ebf']))
+	if s['time']:
+		print('info string time ' + ' '.join('%s %d' % (p, 1000 * t) for p, t in sorted(s['time'].items())))
+	sys.stdout.flush()
+	if LOG:
+		d['engine'] = engine
+		d['depth'] = depth
+		try:
+			with open(LOG, 'a') as f:
+				f.write(json.dumps(d) + '\n')
+		except:
+			print("# Could not write statistics file")